@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+"""
+Measures the throughput of resize4hdtv on a synthetic tree of JPEG pictures. Requires ImageMagick and Wand.
+
+Generates the pictures (plasma fractals, so every picture is different and compresses like a photo),
+runs resize4hdtv() in a fresh process and reports images/second, MB/second, p50/p95 latency per picture
+and the peak RSS. The results are saved as JSON so runs can be compared across commits and modes.
+
+Examples:
+    bench_resize.py -c 100 -r 6000x4000,4000x3000 --portrait=0.25 --duplicates=5 -o before.json
+    bench_resize.py -c 100 -r 6000x4000,4000x3000 --portrait=0.25 --duplicates=5 -j 8 --fast -o after.json
+    bench_resize.py --compare before.json after.json
+"""
+
+import sys, os, getopt, json, time, shutil, tempfile, platform, resource, subprocess, multiprocessing, queue
+
+# The directory with the myutils package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCRIPT = os.path.basename(__file__)
+# Describes a generated tree, a tree is generated again only if the description changed
+SPEC = "bench.json"
+MB = 1024 * 1024
+# Seconds between checks that the process running resize4hdtv is still alive
+POLL_INTERVAL = 1
+
+
+class ValidationException(Exception):
+    """ An exception thrown when a validation error occurs """
+    def __init__(self,*args,**kwargs):
+        Exception.__init__(self,*args,**kwargs)
+
+
+def main(argv):
+    """ Main method """
+    spec = { "count": 50, "resolutions": ["6000x4000"], "portrait": 0.0, "duplicates": 0, "dirs": 4 }
+    options = { "jobs": 1, "fast_decode": False }
+    tree = ""
+    out_path = ""
+    runs = 1
+    try:
+        opts, args = getopt.getopt(argv, "hc:r:d:t:j:fn:o:", ["help", "count=", "resolutions=", "portrait=", "duplicates=", "dirs=",
+                                                             "tree=", "jobs=", "fast", "runs=", "out=", "compare"])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                raise getopt.GetoptError("Help")
+            elif opt in ("-c", "--count"):
+                spec["count"] = _parse_number(arg, int, "count")
+            elif opt in ("-r", "--resolutions"):
+                spec["resolutions"] = [_parse_resolution(r) for r in arg.split(",")]
+            elif opt == "--portrait":
+                spec["portrait"] = _parse_number(arg, float, "portrait")
+            elif opt in ("-d", "--duplicates"):
+                spec["duplicates"] = _parse_number(arg, int, "duplicates")
+            elif opt == "--dirs":
+                spec["dirs"] = max(1, _parse_number(arg, int, "dirs"))
+            elif opt in ("-t", "--tree"):
+                tree = arg
+            elif opt in ("-j", "--jobs"):
+                options["jobs"] = _parse_number(arg, int, "jobs")
+            elif opt in ("-f", "--fast"):
+                options["fast_decode"] = True
+            elif opt in ("-n", "--runs"):
+                runs = max(1, _parse_number(arg, int, "runs"))
+            elif opt in ("-o", "--out"):
+                out_path = arg
+            elif opt == "--compare":
+                if len(args) < 2:
+                    raise getopt.GetoptError("Must have at least two files to compare")
+                compare(args)
+                return
+        bench(spec, options, tree, runs, out_path)
+    except getopt.GetoptError:
+        print("USAGE: {0} <options>".format(SCRIPT))
+        print("       {0} --compare <file> <file>...".format(SCRIPT))
+        print()
+        print("OPTIONS:")
+        print("   -c <number>             The number of pictures, default 50")
+        print("   -r <WxH,...>            The resolutions of the pictures, used in turn, default 6000x4000")
+        print("   -d <number>             The number of duplicates named 'name (1).jpg', default 0")
+        print("   -t <directory>          Generate the pictures here and reuse them next time, default a temporary directory")
+        print("   -j <number>             Passed to resize4hdtv: the number of processes, 0 for one per CPU")
+        print("   -f                      Passed to resize4hdtv: fast decode")
+        print("   -n <number>             The number of runs, default 1")
+        print("   -o <file>               Save the results to this JSON file")
+        print("   -h                      Show help")
+        print("   --portrait=<fraction>   The fraction of pictures in portrait orientation, default 0")
+        print("   --dirs=<number>         The number of sub-directories the pictures are spread over, default 4")
+        print("   --compare               Compare JSON files saved by previous runs")
+        print("   --help                  Show help")
+        sys.exit(1)
+    except ValidationException as ex:
+        print("ERROR: {0}".format("".join(ex.args)))
+        sys.exit(2)
+
+
+def _parse_number(value, type_, name):
+    """ Parses a non-negative number, throws a ValidationException if invalid. """
+    try:
+        number = type_(value)
+    except ValueError:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    if number < 0:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    return number
+
+
+def _parse_resolution(value):
+    """ Parses WxH, throws a ValidationException if invalid. """
+    try:
+        width, height = [int(v) for v in value.lower().split("x")]
+    except ValueError:
+        raise ValidationException("Invalid resolution: '{0}'.".format(value))
+    return "{0}x{1}".format(width, height)
+
+
+def bench(spec, options, tree, runs, out_path):
+    """ Generates the pictures if needed, runs resize4hdtv and reports the results. """
+    temp_dir = tempfile.mkdtemp(prefix="bench_resize.")
+    try:
+        input_dir = tree or os.path.join(temp_dir, "in")
+        generate(input_dir, spec)
+        results = []
+        for run in range(runs):
+            output_dir = os.path.join(temp_dir, "out{0}".format(run))
+            result = _run(input_dir, output_dir, options)
+            _print_result(result)
+            results.append(result)
+            shutil.rmtree(output_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = {
+        "commit": _commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": { "platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count() },
+        "spec": spec,
+        "options": options,
+        "runs": results,
+        # The best run is the least disturbed by whatever else was running
+        "best": max(results, key=lambda r: r["images_per_second"])
+    }
+    if out_path:
+        with open(out_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved to {0}".format(out_path))
+    return report
+
+
+def generate(input_dir, spec):
+    """ Generates the tree of pictures described by spec, does nothing if it was already generated. """
+    spec_path = os.path.join(input_dir, "." + SPEC)
+    try:
+        with open(spec_path) as f:
+            if json.load(f) == spec:
+                print("Reusing {0}".format(input_dir))
+                return
+    except (FileNotFoundError, ValueError):
+        pass
+    from wand.image import Image
+
+    print("Generating {0} pictures in {1}...".format(spec["count"], input_dir))
+    shutil.rmtree(input_dir, ignore_errors=True)
+    paths = []
+    for i in range(spec["count"]):
+        width, height = [int(v) for v in spec["resolutions"][i % len(spec["resolutions"])].split("x")]
+        # Spread portrait pictures evenly
+        if int((i + 1) * spec["portrait"]) > int(i * spec["portrait"]):
+            width, height = min(width, height), max(width, height)
+        else:
+            width, height = max(width, height), min(width, height)
+        dir_ = os.path.join(input_dir, "dir{0}".format(i % spec["dirs"]))
+        os.makedirs(dir_, exist_ok=True)
+        path = os.path.join(dir_, "IMG_{0:05d}.jpg".format(i))
+        with Image(width=width, height=height, pseudo="plasma:") as img:
+            img.format = "jpeg"
+            img.compression_quality = 92
+            img.save(filename=path)
+        paths.append(path)
+    for i in range(min(spec["duplicates"], len(paths))):
+        root, ext = os.path.splitext(paths[i])
+        shutil.copy2(paths[i], "{0} (1){1}".format(root, ext))
+    with open(spec_path, "w") as f:
+        json.dump(spec, f)
+
+
+def _run(input_dir, output_dir, options):
+    """ Runs resize4hdtv in a fresh process so the peak RSS is not polluted by generating the pictures. """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_child, args=(input_dir, output_dir, options, results))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if not process.is_alive():
+                # It may have posted just before exiting
+                try:
+                    result = results.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    raise RuntimeError("resize4hdtv exited with code {0} without a result".format(process.exitcode))
+    process.join()
+    return result
+
+
+def _child(input_dir, output_dir, options, results):
+    """ Runs in the fresh process, measures its own peak RSS: the parent sees only the largest of all the runs. """
+    import contextlib
+    from myutils.resize4hdtv import resize4hdtv
+    from myutils.timings import percentile
+
+    latencies = []
+    sizes = []
+    def on_result(path, result, elapsed):
+        if result:
+            latencies.append(elapsed)
+            sizes.append(os.path.getsize(path))
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        count = resize4hdtv(input_dir, output_dir, on_result=on_result, **options)
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    # This process and the pool processes, they are children of this one and have exited
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put({
+        "count": count,
+        "seconds": seconds,
+        "images_per_second": len(latencies) / seconds,
+        "mb_per_second": sum(sizes) / MB / seconds,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        # Kilobytes on Linux, bytes on macOS
+        "peak_rss_mb": rss / (MB if sys.platform == "darwin" else 1024)
+    })
+
+
+def _commit():
+    """ Returns the current git commit or None. """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(result):
+    print("{0} pictures in {1:.2f}s: {2:.2f} images/s, {3:.2f} MB/s, p50 {4:.3f}s, p95 {5:.3f}s, peak RSS {6:.0f} MB".format(
+        result["count"]["resized"], result["seconds"], result["images_per_second"], result["mb_per_second"],
+        result["latency_p50"], result["latency_p95"], result["peak_rss_mb"]))
+
+
+def compare(paths):
+    """ Prints the best run of each JSON file, relative to the first one. """
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+    base = reports[0]["best"]
+    print("{0:<24} {1:>10} {2:>12} {3:>10} {4:>10} {5:>10} {6:>8}".format("run", "commit", "images/s", "MB/s", "p50", "p95", "RSS MB"))
+    for path, report in zip(paths, reports):
+        best = report["best"]
+        speedup = best["images_per_second"] / base["images_per_second"] if base["images_per_second"] else 0
+        print("{0:<24} {1:>10} {2:>7.2f} x{3:<4.2f} {4:>10.2f} {5:>10.3f} {6:>10.3f} {7:>8.0f}".format(
+            os.path.basename(path)[:24], report["commit"] or "-", best["images_per_second"], speedup, best["mb_per_second"],
+            best["latency_p50"], best["latency_p95"], best["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
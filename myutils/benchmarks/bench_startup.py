@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Measures how long the myutils command takes to start: runs "myutils <command> --help" for each sub-command in a fresh
+process several times and reports the minimum and the median wall time, next to a bare Python interpreter for reference.
+With -m also lists the modules that take the most time to import, from python -X importtime.
+
+Examples:
+    bench_startup.py -n 20 -o before.json
+    bench_startup.py --compare before.json after.json
+"""
+
+import sys, os, getopt, json, time, platform, statistics, subprocess
+
+SCRIPT = os.path.basename(__file__)
+# The directory with the myutils package
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PROJECT_DIR)
+
+
+class ValidationException(Exception):
+    """ An exception thrown when a validation error occurs """
+    def __init__(self,*args,**kwargs):
+        Exception.__init__(self,*args,**kwargs)
+
+
+def main(argv):
+    """ Main method """
+    runs = 10
+    out_path = ""
+    modules = 0
+    try:
+        opts, args = getopt.getopt(argv, "hn:o:m:", ["help", "runs=", "out=", "modules=", "compare"])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                raise getopt.GetoptError("Help")
+            elif opt in ("-n", "--runs"):
+                runs = max(1, _parse_int(arg, "runs"))
+            elif opt in ("-o", "--out"):
+                out_path = arg
+            elif opt in ("-m", "--modules"):
+                modules = _parse_int(arg, "modules")
+            elif opt == "--compare":
+                if len(args) < 2:
+                    raise getopt.GetoptError("Must have at least two files to compare")
+                compare(args)
+                return
+        bench(args, runs, modules, out_path)
+    except getopt.GetoptError:
+        print("USAGE: {0} <options> [<command>...]".format(SCRIPT))
+        print("       {0} --compare <file> <file>...".format(SCRIPT))
+        print()
+        print("OPTIONS:")
+        print("   -n <number>           The number of runs of each command, default 10")
+        print("   -m <number>           Also list this many of the slowest imports of each command")
+        print("   -o <file>             Save the results to this JSON file")
+        print("   -h                    Show help")
+        print("   --compare             Compare JSON files saved by previous runs")
+        print("   --help                Show help")
+        sys.exit(1)
+    except ValidationException as ex:
+        print("ERROR: {0}".format("".join(ex.args)))
+        sys.exit(2)
+
+
+def _parse_int(value, name):
+    """ Parses a non-negative integer, throws a ValidationException if invalid. """
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    if number < 0:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    return number
+
+
+def bench(commands, runs, modules, out_path):
+    """ Times each command, all sub-commands if none specified. """
+    from myutils.cli import COMMANDS
+    commands = commands or sorted(COMMANDS)
+    results = { "python": _time([sys.executable, "-c", "pass"], runs) }
+    _print_result("python", results["python"])
+    for command in commands:
+        results[command] = _time([sys.executable, "-m", "myutils", command, "--help"], runs)
+        _print_result(command, results[command])
+        if modules:
+            for seconds, module in _slowest_imports(command, modules):
+                print("    {0:8.1f} ms  {1}".format(seconds * 1000, module))
+    report = {
+        "commit": _commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": { "platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count() },
+        "runs": runs,
+        "results": results
+    }
+    if out_path:
+        with open(out_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved to {0}".format(out_path))
+    return report
+
+
+def _time(args, runs):
+    """ Runs a command runs times, returns the minimum and the median seconds. The help exits with 1, that is fine. """
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return { "min": min(seconds), "median": statistics.median(seconds) }
+
+
+def _slowest_imports(command, count):
+    """ Returns (seconds, module) of the slowest imports, including the modules they import. """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-m", "myutils", command, "--help"], cwd=PROJECT_DIR,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    # import time: self [us] | cumulative | imported package
+    for line in process.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and line.startswith("import time:") and parts[1].strip().isdigit():
+            imports.append((int(parts[1]) / 1e6, parts[2].rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def _commit():
+    """ Returns the current git commit or None. """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(name, result):
+    print("{0:<14} min {1:7.1f} ms, median {2:7.1f} ms".format(name, result["min"] * 1000, result["median"] * 1000))
+
+
+def compare(paths):
+    """ Prints the median of each command in each JSON file. """
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+    names = list(reports[0]["results"])
+    print("{0:<14} ".format("command") + " ".join("{0:>14}".format((r["commit"] or os.path.basename(p))[:14]) for p, r in zip(paths, reports)))
+    for name in names:
+        cells = []
+        for report in reports:
+            result = report["results"].get(name)
+            cells.append("{0:>11.1f} ms".format(result["median"] * 1000) if result else "{0:>14}".format("-"))
+        print("{0:<14} ".format(name) + " ".join(cells))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
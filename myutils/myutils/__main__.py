@@ -0,0 +1,7 @@
+"""
+Runs the myutils command: python -m myutils <command> <options>
+"""
+
+from myutils.cli import main
+
+main()
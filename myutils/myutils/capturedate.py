@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+Reads the time a picture or a movie was taken from the header of the file, without decoding it:
+- JPEG: the EXIF DateTimeOriginal (or DateTimeDigitized, or DateTime) from the first 64 KiB
+- MOV/MP4: the creation time of the mvhd atom, skipping from atom to atom and reading only the atom headers
+Falls back to the modification time of the file.
+
+The times can be cached by path, size and modification time, so files are read only once.
+"""
+
+import sys, os, json, struct, time
+
+# Number of bytes read from the beginning of a JPEG file, the EXIF segment is at most 64 KiB
+HEADER_SIZE = 64 * 1024
+# Seconds from 1904-01-01, when QuickTime time starts, to 1970-01-01
+_QUICKTIME_EPOCH = 2082844800
+
+# JPEG markers without a length
+_JPEG_STANDALONE = set(range(0xD0, 0xD9)) | { 0x01 }
+_JPEG_APP1 = 0xE1
+_JPEG_SOS = 0xDA
+# Atoms that can start a QuickTime or ISO media file
+_MOVIE_ATOMS = (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot")
+
+# EXIF tags
+_EXIF_IFD = 0x8769
+_DATE_TIME_ORIGINAL = 0x9003
+_DATE_TIME_DIGITIZED = 0x9004
+_DATE_TIME = 0x0132
+_ASCII = 2
+
+
+def capture_time(path, stat=None):
+    """ Returns the time the picture or the movie was taken as seconds since the epoch, the modification time if the header does not tell.
+
+    Arguments:
+        * path -- the file
+        * stat -- the result of os.stat(path) if already known
+    """
+    t = None
+    try:
+        with open(path, "rb") as f:
+            t = _header_time(f)
+    except OSError:
+        pass
+    if t is None:
+        t = (stat or os.stat(path)).st_mtime
+    return t
+
+
+def _header_time(f):
+    """ Returns the time from the header or None. """
+    header = f.read(HEADER_SIZE)
+    try:
+        if header.startswith(b"\xff\xd8"):
+            return _jpeg_time(header)
+        if header[4:8] in _MOVIE_ATOMS:
+            return _movie_time(f)
+    except (struct.error, ValueError, OverflowError, IndexError):
+        # Truncated or corrupt
+        pass
+    return None
+
+
+def _jpeg_time(data):
+    """ Finds the EXIF segment: skips from marker to marker, stops at the picture data. """
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker in _JPEG_STANDALONE:
+            pos += 2
+            continue
+        if marker == _JPEG_SOS:
+            return None
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == _JPEG_APP1 and data[pos + 4:pos + 10] == b"Exif\x00\x00":
+            return _exif_time(data[pos + 10:pos + 2 + length])
+        pos += 2 + length
+    return None
+
+
+def _exif_time(tiff):
+    """ Reads the date from the TIFF structure of the EXIF segment. """
+    order = { b"II": "<", b"MM": ">" }.get(tiff[:2])
+    if order is None:
+        return None
+    ifd0 = _ifd(tiff, order, struct.unpack(order + "I", tiff[4:8])[0])
+    tags = []
+    if _EXIF_IFD in ifd0:
+        exif = _ifd(tiff, order, struct.unpack(order + "I", ifd0[_EXIF_IFD][2])[0])
+        tags = [exif.get(_DATE_TIME_ORIGINAL), exif.get(_DATE_TIME_DIGITIZED)]
+    tags.append(ifd0.get(_DATE_TIME))
+    for tag in tags:
+        t = _exif_date(tiff, order, tag)
+        if t is not None:
+            return t
+    return None
+
+
+def _ifd(tiff, order, offset):
+    """ Returns the entries of an image file directory: tag -> (type, count, value or offset as 4 bytes). """
+    count = struct.unpack(order + "H", tiff[offset:offset + 2])[0]
+    entries = {}
+    for i in range(offset + 2, offset + 2 + 12 * count, 12):
+        tag, type_, n = struct.unpack(order + "HHI", tiff[i:i + 8])
+        entries[tag] = (type_, n, tiff[i + 8:i + 12])
+    return entries
+
+
+def _exif_date(tiff, order, entry):
+    """ Parses "YYYY:MM:DD HH:MM:SS" in local time, returns None if missing or blank. """
+    if entry is None or entry[0] != _ASCII or entry[1] < 19:
+        return None
+    offset = struct.unpack(order + "I", entry[2])[0]
+    text = tiff[offset:offset + 19].decode("ascii", "replace")
+    try:
+        return time.mktime(time.strptime(text, "%Y:%m:%d %H:%M:%S"))
+    except ValueError:
+        return None
+
+
+def _movie_time(f):
+    """ Finds moov/mvhd, reads only the atom headers on the way. """
+    end = os.fstat(f.fileno()).st_size
+    moov = _find_atom(f, 0, end, b"moov")
+    if moov is None:
+        return None
+    mvhd = _find_atom(f, moov[0], moov[1], b"mvhd")
+    if mvhd is None:
+        return None
+    f.seek(mvhd[0])
+    data = f.read(12)
+    if len(data) < 8 or data[0] == 1 and len(data) < 12:
+        # Truncated, for example still being copied
+        return None
+    # Version 1 has 64 bit times
+    seconds = struct.unpack(">Q", data[4:12])[0] if data[0] == 1 else struct.unpack(">I", data[4:8])[0]
+    if seconds <= _QUICKTIME_EPOCH:
+        # Not set
+        return None
+    return seconds - _QUICKTIME_EPOCH
+
+
+def _find_atom(f, start, end, name):
+    """ Returns (start, end) of the data of the first atom with the name between start and end or None. """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack(">I4s", header[:8])
+        data = pos + 8
+        if size == 1:
+            # 64 bit size
+            if len(header) < 16:
+                return None
+            size = struct.unpack(">Q", header[8:16])[0]
+            data = pos + 16
+        elif size == 0:
+            # Up to the end
+            size = end - pos
+        if size < data - pos:
+            return None
+        if kind == name:
+            return data, min(pos + size, end)
+        pos += size
+    return None
+
+
+class Cache(object):
+    """ Capture times by path, valid while the size and the modification time of the file stay the same. Saved as JSON.
+    After reading the times, hits is the number of files not read thanks to the cache. """
+
+    def __init__(self, path):
+        self.path = path
+        # Absolute path -> [size, mtime in ns, capture time]
+        self._entries = {}
+        self._changed = False
+        self.hits = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print("Cannot read {0}, reading all files...".format(path))
+
+    def capture_time(self, path, stat=None):
+        """ Like capture_time(), reads the file only if not cached or changed since. """
+        stat = stat or os.stat(path)
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            self.hits += 1
+            return entry[2]
+        t = capture_time(path, stat)
+        self._entries[key] = [stat.st_size, stat.st_mtime_ns, t]
+        self._changed = True
+        return t
+
+    def discard(self, path):
+        """ Forgets a file that will not be read again, for example because it was moved where the times are not read. """
+        if self._entries.pop(os.path.abspath(path), None) is not None:
+            self._changed = True
+
+    def save(self):
+        """ Saves the cache if changed, replaces the previous one only after the new one was written completely. """
+        if not self._changed:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self._changed = False
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        print("{0}: {1}".format(arg, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(capture_time(arg)))))
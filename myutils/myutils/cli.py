@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""
+The myutils command: runs one of the tools as a sub-command, for example "myutils flatten -i <in> -o <out>".
+
+Only the module of the sub-command is imported. The modules import heavy native libraries (ImageMagick through Wand,
+libmagic, ctypes) only when they need them, so the command starts fast even when it only prints the help.
+"""
+
+import sys, importlib
+
+# Sub-command -> (module, description)
+COMMANDS = {
+    "date2dir": ("date2dir", "Move files to yyyy.mm.dd directories by capture date"),
+    "fcp2mydvd": ("fcp2mydvd", "Create a MyDVD project from the chapter markers of a Final Cut Pro X project"),
+    "flatten": ("flatten", "Copy the JPEG pictures of a tree to one directory, numbered"),
+    "resize4hdtv": ("resize4hdtv", "Resize pictures for HDTV"),
+}
+
+
+def main(argv=None):
+    """ Main method """
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) == 0 or argv[0] in ("-h", "--help", "help"):
+        _usage()
+        sys.exit(0 if argv else 1)
+    if argv[0] not in COMMANDS:
+        print("ERROR: Unknown command '{0}'.".format(argv[0]))
+        _usage()
+        sys.exit(1)
+    # The tools import each other relative to the package, sys.path is not changed
+    if __package__:
+        module = importlib.import_module("." + COMMANDS[argv[0]][0], __package__)
+    else:
+        # Run as a script, next to the tools
+        module = importlib.import_module(COMMANDS[argv[0]][0])
+    module.main(argv[1:])
+
+
+def _usage():
+    print("USAGE: myutils <command> <options>")
+    print("       myutils <command> --help")
+    print("")
+    print("COMMANDS:")
+    for name in sorted(COMMANDS):
+        print("   {0:<21} {1}".format(name, COMMANDS[name][1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,84 +2,433 @@
 
 """
 Creates sub-directories in the format yyy.mm.dd under the specified output directory and moves files from the specified input directory according to creation dates.
-The output directory can be the same as the input directory. Skips files starting with dot.
+The creation date is read from the header of the file (EXIF for JPEG, mvhd for MOV/MP4), the modification date if not found there.
+The output directory can be the same as the input directory. Skips files starting with dot. A file is never moved over
+another file with the same name, for example from another sub-directory with -r: it stays where it is and is reported as failed.
+
+Each directory is listed once with os.scandir() and each file is stat'ed once. Files are renamed in batches, one batch per
+source and target directory, relative to open directory handles where the system supports it. Files that cannot be renamed
+because the output is on another device are copied in parallel and then deleted.
+On network file systems, --io-limit stats, creates the directories and renames many files at once, see metaio.
 
 Created on Oct 25, 2016
 
 @author: Florin Rosca
 """
 
-import sys, os, getopt, time
+import sys, os, getopt, time, re, errno, collections
+
+if __package__:
+    from . import capturedate, fastcopy, timings, inotify, scanner
+else:
+    # Run as a script
+    import capturedate, fastcopy, timings, inotify, scanner
 
 SCRIPT = os.path.basename(__file__)
+# Keeps the files below between runs, hidden in the output directory. Writing them changes the modification time of this
+# directory only, not the one of the output directory, which can be an input directory listed with --index
+STATE_DIR = ".date2dir"
+# Caches the creation dates read from the files
+CACHE = "cache.json"
+# Names of the directories created by date2dir, skipped when looking for files recursively
+DATE_DIR = re.compile(r"^\d{4}\.\d{2}\.\d{2}$")
+# The files to move and the sub-directories to look into
+FILES = (scanner.not_hidden, scanner.is_file)
+DIRS = (scanner.not_hidden, scanner.not_matching(DATE_DIR))
+# Remembers the directories listed
+INDEX = "index.json"
+# Rename relative to open directory handles, saves looking up the directories for each file
+_DIR_FD = os.rename in os.supports_dir_fd
+# Seconds without events before a watched file is moved
+SETTLE = 0.5
+
+
+class ValidationException(Exception):
+    """ An exception thrown when a validation error occurs """
+    def __init__(self,*args,**kwargs):
+        Exception.__init__(self,*args,**kwargs)
+
 
 def main(argv):
     input_dir = ""
     output_dir = ""
+    recursive = False
+    jobs = 4
+    verbose = False
+    watching = False
+    settle = SETTLE
+    use_index = False
+    io_limit = 0
     try:
         if len(argv) == 0:
             raise getopt.GetoptError("Must have at least one argument")
-        opts, _ = getopt.getopt(argv, "hi:o:", ["help", "in=", "out="])
+        opts, _ = getopt.getopt(argv, "hi:o:rj:vw", ["help", "in=", "out=", "recursive", "jobs=", "verbose", "watch", "settle=", "index", "io-limit="])
         for opt, arg in opts:
             if opt in ("-h", "--help"):
-                raise getopt.GetoptError("Help") 
+                raise getopt.GetoptError("Help")
             elif opt in ("-i", "--in"):
                 input_dir = arg
             elif opt in ("-o", "--out"):
                 output_dir = arg
+            elif opt in ("-r", "--recursive"):
+                recursive = True
+            elif opt in ("-j", "--jobs"):
+                jobs = _parse_int(arg, "jobs")
+            elif opt in ("-v", "--verbose"):
+                verbose = True
+            elif opt in ("-w", "--watch"):
+                watching = True
+            elif opt == "--settle":
+                settle = _parse_int(arg, "settle time") / 1000
+            elif opt == "--index":
+                use_index = True
+            elif opt == "--io-limit":
+                io_limit = _parse_int(arg, "I/O limit")
         if not output_dir:
             output_dir = input_dir
-        date2dir(input_dir, output_dir)
+        if watching:
+            if recursive:
+                raise ValidationException("Cannot watch sub-directories.")
+            watch(input_dir, output_dir, jobs=jobs, verbose=verbose, settle=settle, io_limit=io_limit)
+        else:
+            date2dir(input_dir, output_dir, recursive=recursive, jobs=jobs, verbose=verbose, use_index=use_index, io_limit=io_limit)
     except getopt.GetoptError:
         print("USAGE: {0} <options>".format(SCRIPT))
         print("")
         print("OPTIONS:")
         print("   -i <directory>        The input directory")
         print("   -o <directory>        The output directory")
+        print("   -r                    Also move the files in the sub-directories, except the yyyy.mm.dd ones")
+        print("   -j <number>           The number of files copied in parallel when moving to another device, default 4, 0 for the default of the thread pool")
+        print("   -v                    Show each file")
+        print("   -w                    Keep running and move new files as soon as they are written (Linux only)")
         print("   -h                    Show help")
         print("   --in=<directory>      The input directory")
         print("   --out=<directory>     The output directory")
+        print("   --recursive           Also move the files in the sub-directories, except the yyyy.mm.dd ones")
+        print("   --jobs=<number>       The number of files copied in parallel when moving to another device, default 4, 0 for the default of the thread pool")
+        print("   --verbose             Show each file")
+        print("   --watch               Keep running and move new files as soon as they are written (Linux only)")
+        print("   --settle=<ms>         Wait this long after the last write before moving a watched file, default 500")
+        print("   --index               Do not list again the sub-directories that did not change since the last run")
+        print("   --io-limit=<number>   Stat, create directories and rename this many files at once, for network file systems,")
+        print("                         default 0: one at a time. Set MYUTILS_IO_LATENCY=<ms> to add latency to each, for testing")
         print("   --help                Show help")
         sys.exit(1)
+    except ValidationException as ex:
+        print("ERROR: {0}".format("".join(ex.args)))
+        sys.exit(2)
 
 
-def _accept(dir_, file):
-    """ Returns True if the file should be processed, False if not. """
-    if file.startswith("."):
-        return False
-    return True
-            
-            
-def _created(path):
+def _parse_int(value, name):
+    """ Parses a non-negative integer option, throws a ValidationException if invalid. """
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    if number < 0:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    return number
+
+
+def _created(entry, cache, stat=None):
     """ Returns a string yyyy.mm.dd """
-    t = os.path.getmtime(path)
+    t = cache.capture_time(entry.path, stat or entry.stat())
     return time.strftime("%Y.%m.%d", time.localtime(t))
 
 
-def date2dir(input_dir, output_dir):
-    """ Moves files to sub-directories of output_dir named "yyyy.mm.dd """
-    paths = []
-    
-    # Build the list of files to move
-    for f in os.listdir(input_dir):
-        if not _accept(input_dir, f):
+def date2dir(input_dir, output_dir, recursive=False, jobs=4, verbose=False, use_index=False, io_limit=0):
+    """ Moves files to sub-directories of output_dir named "yyyy.mm.dd.
+    If use_index is True, sub-directories that did not change since the last run are not listed again.
+    If io_limit is not 0, up to io_limit stat, mkdir and rename operations run at once. """
+    start = time.perf_counter()
+    count = { "dirs": 0, "files": 0, "moved": 0, "copied": 0, "failed": 0 }
+    # Before listing: creating it changes the modification time of the output directory
+    state_dir = os.path.join(output_dir, STATE_DIR)
+    os.makedirs(state_dir, exist_ok=True)
+    cache = capturedate.Cache(os.path.join(state_dir, CACHE))
+    # Without -r the sub-directories are not listed: an index saved with or without it, or for another input directory, is not used
+    index = scanner.Index(os.path.join(state_dir, INDEX), input_dir, [os.path.abspath(input_dir), recursive]) if use_index else None
+    files = scanner.Scanner(input_dir, filters=FILES, dir_filters=DIRS, recursive=recursive, index=index,
+                            onerror=lambda ex: print("ERROR: {0}".format(ex)))
+    failed = set()
+    listed = list(files.walk())
+    try:
+        _sort([(dir_, entry) for dir_, entries in listed for entry in entries], output_dir, cache, count, jobs, verbose, failed,
+              io_limit=io_limit)
+    finally:
+        cache.save()
+    count["dirs"] = files.dirs
+    count["cached"] = cache.hits
+    if index is not None:
+        # Moving the files out changed the modification time the directories had when listed
+        for dir_, entries in listed:
+            if entries:
+                index.refresh(dir_)
+        # Directories with files that failed are listed again next time
+        for dir_ in failed:
+            index.discard(dir_)
+        index.save()
+        print("{0} directories unchanged since the last run.".format(files.skipped))
+    print("{0} directories, {1} files ({2} dates cached), {3} moved, {4} copied to another device, {5} failed in {6:.1f}s.".format(
+        count["dirs"], count["files"], count["cached"], count["moved"], count["copied"], count["failed"], time.perf_counter() - start))
+
+
+def watch(input_dir, output_dir, jobs=4, verbose=False, settle=SETTLE, io_limit=0):
+    """ Moves the files like date2dir(), then waits for new files and moves them as soon as they were written. Linux only.
+
+    A file is moved once it was closed after writing or moved into the input directory and nothing happened to it for settle seconds,
+    so files written in several steps are not moved half-written. The input directory is not listed again, except when the kernel
+    dropped events because too many came at once.
+    """
+    if not inotify.available():
+        raise ValidationException("Watching needs the inotify API of Linux.")
+    # Start watching before the first pass, files arriving during the pass are not missed
+    with inotify.Watcher(input_dir, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO) as watcher:
+        date2dir(input_dir, output_dir, jobs=jobs, verbose=verbose, io_limit=io_limit)
+        print("Watching {0}...".format(input_dir))
+        cache = capturedate.Cache(os.path.join(output_dir, STATE_DIR, CACHE))
+        # File name -> time of the last event
+        pending = {}
+        try:
+            while True:
+                timeout = max(0, min(pending.values()) + settle - time.monotonic()) if pending else None
+                for mask, name in watcher.read(timeout):
+                    if mask & inotify.IN_IGNORED:
+                        print("{0} is gone.".format(input_dir))
+                        return
+                    if mask & inotify.IN_Q_OVERFLOW:
+                        # Events were lost, the only case the directory is listed again
+                        for entry in scanner.Scanner(input_dir, filters=FILES, recursive=False):
+                            pending[entry.name] = time.monotonic()
+                    elif not mask & inotify.IN_ISDIR and scanner.not_hidden(scanner.Entry(input_dir, name)):
+                        pending[name] = time.monotonic()
+                now = time.monotonic()
+                files = []
+                for name in [name for name, t in pending.items() if now - t >= settle]:
+                    del pending[name]
+                    entry = scanner.Entry(input_dir, name)
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        # Already moved or deleted
+                        continue
+                    if time.time() - stat.st_mtime < settle:
+                        # Written since the event, still being written
+                        pending[name] = now
+                    elif entry.is_file():
+                        files.append((input_dir, entry))
+                if files:
+                    count = { "dirs": 0, "files": len(files), "moved": 0, "copied": 0, "failed": 0 }
+                    _sort(files, output_dir, cache, count, jobs, True, set(), report=False, io_limit=io_limit)
+                    cache.save()
+        except KeyboardInterrupt:
+            print("Stopped.")
+        finally:
+            cache.save()
+
+
+def _sort(files, output_dir, cache, count, jobs, verbose, failed, report=True, io_limit=0):
+    """ Moves the (directory, entry) files, adds the directories of the files that failed to failed. Prints the progress if report is True.
+    If io_limit is not 0, the metadata operations run concurrently. """
+    # Build the list of files to move: source directory -> target directory name -> file names
+    count["files"] = len(files)
+    stats = _stat_all([entry for _, entry in files], io_limit) if io_limit else {}
+    progress = timings.Progress("Reading dates", count["files"])
+    plan = collections.OrderedDict()
+    # Target directory name -> names of the files already there or planned to move there. Renames replace existing files:
+    # a file whose name is taken stays where it is
+    taken = {}
+    for dir_, entry in files:
+        progress.update()
+        try:
+            name = _created(entry, cache, stats.get(entry.path))
+        except OSError as ex:
+            print("ERROR: {0}: {1}".format(entry.path, ex))
+            count["failed"] += 1
+            failed.add(dir_)
             continue
-        p = os.path.join(input_dir, f)
-        if os.path.isfile(p):
-            paths.append(p)
-            
+        if name not in taken:
+            taken[name] = _names(os.path.join(output_dir, name))
+        if entry.name in taken[name]:
+            print("ERROR: {0}: {1} already exists".format(entry.path, os.path.join(output_dir, name, entry.name)))
+            count["failed"] += 1
+            failed.add(dir_)
+            continue
+        taken[name].add(entry.name)
+        plan.setdefault(dir_, collections.OrderedDict()).setdefault(name, []).append(entry.name)
+    if report:
+        progress.finish()
+
     # Move files
-    for p in paths:
-        name = _created(p)
-        subdir = os.path.join(output_dir, name)
-        print(subdir)
-        if not os.path.exists(subdir):
-            os.mkdir(subdir)
-        renamed = os.path.join(output_dir, name, os.path.basename(p))
-        print("{0} -> {1}".format(p, renamed))    
-        os.rename(p, renamed)
-
-    
+    progress = timings.Progress("Moving", count["files"])
+    created = set()
+    other_device = []
+    renamed = _rename_concurrently(plan, output_dir, io_limit, other_device, count, failed) if io_limit else None
+    for dir_, targets in plan.items():
+        for name, names in targets.items():
+            if renamed is not None:
+                moved = renamed[dir_, name]
+            else:
+                _mkdir(output_dir, name, created)
+                moved = _rename_all(dir_, os.path.join(output_dir, name), names, other_device, count, failed)
+            for file in moved:
+                old_path = os.path.join(dir_, file)
+                new_path = os.path.join(output_dir, name, file)
+                if verbose:
+                    print("{0} -> {1}".format(old_path, new_path))
+                # Files are not read in the output directory: keep only the times of the files still in the input directory
+                cache.discard(old_path)
+            progress.update(len(names))
+    if report:
+        progress.finish()
+    if other_device:
+        _copy_all(other_device, jobs, cache, count, verbose, failed, report)
+
+
+def _names(dir_):
+    """ Returns the names of the files in a directory, an empty set if it cannot be listed, for example because it does not exist yet. """
+    try:
+        return set(os.listdir(dir_))
+    except OSError:
+        return set()
+
+
+def _mkdir(output_dir, name, created):
+    """ Creates the target directory unless already created or found in this run. """
+    if name in created:
+        return
+    os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+    created.add(name)
+
+
+def _rename_all(src_dir, dst_dir, files, other_device, count, failed):
+    """ Renames the files from one directory to another. Returns the names of the files moved,
+    adds (source path, target path) to other_device for the files that must be copied. """
+    moved = []
+    src_fd = dst_fd = None
+    try:
+        if _DIR_FD:
+            src_fd = os.open(src_dir, os.O_RDONLY)
+            dst_fd = os.open(dst_dir, os.O_RDONLY)
+        for file in files:
+            try:
+                if _DIR_FD:
+                    os.rename(file, file, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+                else:
+                    os.rename(os.path.join(src_dir, file), os.path.join(dst_dir, file))
+            except OSError as ex:
+                if ex.errno == errno.EXDEV:
+                    other_device.append((os.path.join(src_dir, file), os.path.join(dst_dir, file)))
+                else:
+                    print("ERROR: {0}: {1}".format(os.path.join(src_dir, file), ex))
+                    count["failed"] += 1
+                    failed.add(src_dir)
+                continue
+            moved.append(file)
+            count["moved"] += 1
+    finally:
+        for fd in (src_fd, dst_fd):
+            if fd is not None:
+                os.close(fd)
+    return moved
+
+
+def _stat_all(entries, io_limit):
+    """ Stats up to io_limit entries at once, returns path -> stat result. Entries that cannot be stat'ed are left out, reading the date reports them. """
+    # Imports asyncio, not needed when starting
+    if __package__:
+        from . import metaio
+    else:
+        import metaio
+    fs = metaio.default_fs()
+    results = metaio.run((metaio.Operation(fs.stat, (entry.path,)) for entry in entries), io_limit)
+    return { entry.path: result for entry, (result, ex) in zip(entries, results) if ex is None }
+
+
+def _rename_concurrently(plan, output_dir, io_limit, other_device, count, failed):
+    """ Like _mkdir() and _rename_all() for the whole plan, with up to io_limit operations at once.
+    The renames into a directory wait for the directory to be created, renames to the same path keep the order of the plan.
+    Returns (source directory, target directory name) -> names of the files moved. """
+    if __package__:
+        from . import metaio
+    else:
+        import metaio
+    fs = metaio.default_fs()
+    operations = []
+    # Target directory name -> index of its mkdir operation
+    mkdirs = {}
+    renames = []
+    for dir_, targets in plan.items():
+        for name, names in targets.items():
+            if name not in mkdirs:
+                mkdirs[name] = len(operations)
+                operations.append(metaio.Operation(fs.mkdir, (os.path.join(output_dir, name),)))
+            for file in names:
+                src = os.path.join(dir_, file)
+                dst = os.path.join(output_dir, name, file)
+                renames.append((dir_, name, file, len(operations)))
+                operations.append(metaio.Operation(fs.rename, (src, dst), key=dst, after=(mkdirs[name],)))
+    results = metaio.run(operations, io_limit)
+    moved = { (dir_, name): [] for dir_, targets in plan.items() for name in targets }
+    for dir_, name, file, i in renames:
+        ex = results[i][1]
+        if ex is None:
+            moved[dir_, name].append(file)
+            count["moved"] += 1
+        elif isinstance(ex, OSError) and ex.errno == errno.EXDEV:
+            other_device.append((os.path.join(dir_, file), os.path.join(output_dir, name, file)))
+        else:
+            print("ERROR: {0}: {1}".format(os.path.join(dir_, file), ex))
+            count["failed"] += 1
+            failed.add(dir_)
+    return moved
+
+
+def _copy_all(moves, jobs, cache, count, verbose, failed, report=True):
+    """ Copies the (source path, target path) pairs in parallel and deletes the sources. """
+    # Only needed across devices, not imported when starting
+    import concurrent.futures
+    if report:
+        print("Copying {0} files to another device...".format(len(moves)))
+    progress = timings.Progress("Copying", len(moves))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or None) as executor:
+        futures = [executor.submit(_copy_and_delete, src, dst) for src, dst in moves]
+        for (src, dst), future in zip(moves, futures):
+            try:
+                future.result()
+            except OSError as ex:
+                print("ERROR: {0}: {1}".format(src, ex))
+                count["failed"] += 1
+                failed.add(os.path.dirname(src))
+                continue
+            if verbose:
+                print("{0} -> {1}".format(src, dst))
+            cache.discard(src)
+            count["copied"] += 1
+            progress.update()
+    if report:
+        progress.finish()
+
+
+def _copy_and_delete(src, dst):
+    """ Copies with the metadata to a temporary name, renames and deletes the source. The target never holds a partial file
+    and an existing target is not replaced. """
+    dir_, name = os.path.split(dst)
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "File exists", dst)
+    temp_path = os.path.join(dir_, "." + name + ".tmp")
+    try:
+        fastcopy.copy2(src, temp_path)
+        os.replace(temp_path, dst)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(src)
+
+
 if __name__ == "__main__":
     main(sys.argv[1:])
-    
\ No newline at end of file
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Finds files with identical content using a staged index: files are grouped by size first, then by a hash of
+the first chunk and only then by a hash of the whole file. Files with a unique size are never read and files
+with a unique first chunk are read only up to that chunk.
+"""
+
+import sys, os, hashlib, collections
+
+# Number of bytes hashed in the second stage
+CHUNK_SIZE = 64 * 1024
+# Number of bytes read at once in the third stage
+READ_SIZE = 1024 * 1024
+
+
+def find_duplicates(files):
+    """ Returns a dictionary: duplicate path -> original path.
+
+    Arguments:
+        * files -- an iterable of (path, size) tuples. Of several identical files the first one is the original
+    """
+    duplicates = {}
+    by_size = collections.OrderedDict()
+    for path, size in files:
+        by_size.setdefault(size, []).append(path)
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        if size == 0:
+            _add(duplicates, paths)
+            continue
+        for same_head in _group(paths, _head_hash):
+            if size <= CHUNK_SIZE:
+                # The first chunk is the whole file
+                _add(duplicates, same_head)
+                continue
+            for same in _group(same_head, _full_hash):
+                _add(duplicates, same)
+    return duplicates
+
+
+def head_hash(path):
+    """ Returns a hash of the first chunk of a file as a hexadecimal string, the same as content_hash() for a file of at most CHUNK_SIZE bytes. """
+    return _head_hash(path).hex()
+
+
+def content_hash(path):
+    """ Returns a hash of the whole content of a file as a hexadecimal string, to remember and compare later. """
+    return _full_hash(path).hex()
+
+
+def _add(duplicates, paths):
+    """ Marks all paths but the first as duplicates of the first. """
+    for path in paths[1:]:
+        duplicates[path] = paths[0]
+
+
+def _group(paths, hash_):
+    """ Generates the groups of more than one path with the same hash, in the order of the paths. Files that cannot be read are left out. """
+    groups = collections.OrderedDict()
+    for path in paths:
+        try:
+            groups.setdefault(hash_(path), []).append(path)
+        except OSError:
+            continue
+    for group in groups.values():
+        if len(group) > 1:
+            yield group
+
+
+def _head_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(CHUNK_SIZE), digest_size=16).digest()
+
+
+def _full_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            h.update(data)
+    return h.digest()
+
+
+if __name__ == "__main__":
+    paths = []
+    for top in sys.argv[1:]:
+        for dirpath, _, names in os.walk(top):
+            paths.extend(os.path.join(dirpath, name) for name in names)
+    for duplicate, original in sorted(find_duplicates((path, os.path.getsize(path)) for path in paths).items()):
+        print("{0} = {1}".format(duplicate, original))
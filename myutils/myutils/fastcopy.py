@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Copies files using the fastest way the kernel offers, keeping the metadata like shutil.copy2():
+1. A reflink (FICLONE), which shares the data blocks on file systems that support it (btrfs, XFS)
+2. os.copy_file_range(), which copies inside the kernel and lets the file system or the NFS/SMB server do the work
+3. os.sendfile(), which copies inside the kernel
+4. shutil.copyfileobj(), which copies through a user space buffer
+
+Each way falls back to the next one when not supported for the two files.
+link_or_copy2() makes a hard link instead when both files are on the same file system.
+"""
+
+import sys, os, errno, shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# Bytes per call for copy_file_range and sendfile, large calls are interrupted less often
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errors meaning "not supported for these files", try the next way
+_UNSUPPORTED = { errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP, errno.EBADF, errno.EPERM, errno.ETXTBSY }
+if hasattr(errno, "ENOTSUP"):
+    _UNSUPPORTED.add(errno.ENOTSUP)
+# Errors meaning "cannot link these files", copy instead
+_NO_LINK = { errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOSYS, errno.EOPNOTSUPP }
+
+HARDLINK = "hardlink"
+
+
+def link_or_copy2(src, dst):
+    """ Makes dst a hard link to src if possible, otherwise copies like copy2(). Returns HARDLINK or the way the data was copied. """
+    try:
+        os.link(src, dst)
+        return HARDLINK
+    except OSError as ex:
+        if ex.errno not in _NO_LINK:
+            raise
+    return copy2(src, dst)
+
+
+def copy2(src, dst):
+    """ Copies the data and the metadata (permissions, times, flags) like shutil.copy2(). Returns the way the data was copied. """
+    method = copyfile(src, dst)
+    shutil.copystat(src, dst)
+    return method
+
+
+def copyfile(src, dst):
+    """ Copies the data. Returns the way it was copied: "reflink", "copy_file_range", "sendfile" or "read/write". """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for name, method in _METHODS:
+            try:
+                if method(fsrc.fileno(), fdst.fileno(), size):
+                    return name
+            except OSError as ex:
+                if ex.errno not in _UNSUPPORTED:
+                    raise
+            # Start over with the next way, something may have been copied already
+            fdst.truncate(0)
+        fsrc.seek(0)
+        fdst.seek(0)
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+        return "read/write"
+
+
+def _reflink(src_fd, dst_fd, size):
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    return True
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    offset = 0
+    while offset < size:
+        n = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - offset), offset, offset)
+        if n == 0:
+            # Some file systems (procfs, sysfs) report no data, let the next way decide
+            return offset > 0 and _done(src_fd, offset)
+        offset += n
+    return True
+
+
+def _sendfile(src_fd, dst_fd, size):
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        return False
+    offset = 0
+    while offset < size:
+        n = os.sendfile(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+        if n == 0:
+            return offset > 0 and _done(src_fd, offset)
+        offset += n
+    return True
+
+
+def _done(src_fd, offset):
+    """ Returns True if the source file shrank while copying and offset is its new end. """
+    return os.fstat(src_fd).st_size <= offset
+
+
+_METHODS = [("reflink", _reflink), ("copy_file_range", _copy_file_range), ("sendfile", _sendfile)]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("USAGE: {0} <source> <destination>".format(os.path.basename(__file__)))
+        sys.exit(1)
+    print(copy2(sys.argv[1], sys.argv[2]))
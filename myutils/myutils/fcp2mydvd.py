@@ -2,7 +2,8 @@
 
 """
 Converts Final Cut Pro chapter markers to Toast MyDVD.
-Uses Python XML DOM, see https://docs.python.org/2/library/xml.dom.html
+Reads the Final Cut Pro XML with ElementTree.iterparse, see https://docs.python.org/3/library/xml.etree.elementtree.html
+Splices the chapters into the MyDVD file when it can, else uses Python XML DOM, see https://docs.python.org/2/library/xml.dom.html
 
 Created on Nov 4, 2016
 
@@ -10,14 +11,33 @@ Created on Nov 4, 2016
 """
 
 from fractions import Fraction
-import sys, os, re, getopt
-from xml.dom.minidom import parse
+import sys, os, re, getopt, csv, collections, io, mmap
+from xml.dom import Node
+from xml.dom.minidom import Document, parse, parseString
+from xml.etree import ElementTree
 
-from xmlutils import ParseException
-import xmlutils
+if __package__:
+    from . import xmlutils
+    from .xmlutils import ParseException
+else:
+    # Run as a script
+    import xmlutils
+    from xmlutils import ParseException
 
 
 SCRIPT = os.path.basename(__file__)
+# The output file is written through a buffer of this size
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Empty elements MyDVD wants as <tag></tag>, the tags the previous regular expression replacement matched
+_EMPTY_TAG = re.compile(r'[0-9A-Za-z]+$')
+# The path to the element replaced by the chapters, the children of the menu of the first title
+_TITLE_MENU_CHILDREN = (b'MDProject', b'MDMenu', b'children', b'MDTitle', b'children', b'MDMenu', b'children')
+# MDTitle in the path, its preview thumbnail has the URL of the movie
+_TITLE_DEPTH = 4
+# Comments, CDATA sections, processing instructions and declarations, then tags: (/ for end tags, name)
+_XML_TOKEN = re.compile(rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<[?!][^>]*>|<(/?)([^\s/>]+)[^>]*>', re.DOTALL)
+# What the DOM path drops before the root element: only the XML declaration, written again as the DOM writes it
+_PROLOG = re.compile(rb'\s*(<\?xml[^>]*\?>)?\s*$')
 _verbose = False
 
 class FractionalTime(object):
@@ -150,11 +170,12 @@ def main(argv):
     fcp_project = ""
     mydvd_path = ""
     out_path = ""
+    batch_path = ""
     _verbose = False
     try:
         if len(argv) == 0:
             raise getopt.GetoptError('Must have at least one argument')
-        opts, _ = getopt.getopt(argv, 'hf:e:p:m:v:o', ['help', 'fcp=', 'event=', 'project=', 'mydvd=', 'out=', 'verbose'])
+        opts, _ = getopt.getopt(argv, 'hf:e:p:m:v:ob:', ['help', 'fcp=', 'event=', 'project=', 'mydvd=', 'out=', 'verbose', 'batch='])
         
         for opt, arg in opts:
             if opt in ('-h', '--help'):
@@ -171,9 +192,14 @@ def main(argv):
                 out_path = arg
             elif opt in ('-v', '--verbose'):
                 _verbose = True
+            elif opt in ('-b', '--batch'):
+                batch_path = arg
             
         if not fcp_path:
             raise getopt.GetoptError('Missing Final Cut Pro XML file')
+        if batch_path:
+            fcp2mydvd_batch(fcp_path, batch_path)
+            return
         if not fcp_event:
             raise getopt.GetoptError('Missing event name')
         if not fcp_project:
@@ -194,6 +220,7 @@ def main(argv):
         print('   -o <file>           The output Toast MyDVD file')
         print('   -h                  Show help')
         print('   -v                  Show details')
+        print('   -b <file>           Convert many projects at once, see --batch')
         print('   --fcp=<file>        The Final Cut Pro XML file')
         print('   --event=<NAME>      The event name in the Final Cut Pro XML file')
         print('   --project=<NAME>    The project name under the event in the Final Cut Pro XML file')
@@ -201,6 +228,8 @@ def main(argv):
         print('   --out=<file>        The output Toast MyDVD file')
         print('   --help              Show help')
         print('   --verbose           Show details')
+        print('   --batch=<file>      Convert many projects at once, instead of --event, --project, --mydvd and --out.')
+        print('                       The file has one line per project: event,project,MyDVD file,output MyDVD file')
         print('')
         print('WORKFLOW:')
         print('   1. Final Cut Pro: Share movie as Master File, H-264 encoded')
@@ -221,6 +250,48 @@ def fcp2mydvd(fcp_path, fcp_event, fcp_project, mydvd_path, out_path):
     _set_mydvd_chapters(mydvd_path, _get_fcp_project(fcp_path, fcp_event, fcp_project), out_path)
 
 
+def fcp2mydvd_batch(fcp_path, batch_path):
+    """ Converts the Final Cut Pro chapter markers of many projects to Toast MyDVD. 
+    The Final Cut Pro XML file is read once for all the projects. The chapters are spliced into the MyDVD files, or if they cannot be,
+    each MyDVD file is parsed once, then copied for each project using it.
+    
+    Arguments:
+        * fcp_path -- the path to the input FCP XML file
+        * batch_path -- a CSV file with one line per project: event name, project name, MyDVD file, output MyDVD file
+    """
+    global _verbose
+    rows = _read_batch(batch_path)
+    if _verbose:
+        print('Looking for {0} projects...'.format(len(rows)))
+        print()
+    projects = _read_fcp_projects(fcp_path, [(event, project) for event, project, _, _ in rows])
+    # MyDVD file -> DOM, parsed once
+    templates = {}
+    for event, project, mydvd_path, out_path in rows:
+        # Parsed only if the chapters cannot be spliced in
+        if mydvd_path not in templates:
+            if _splice_mydvd_chapters(mydvd_path, projects[(event, project)], out_path):
+                continue
+            templates[mydvd_path] = parse(mydvd_path)
+        _set_mydvd_chapters(mydvd_path, projects[(event, project)], out_path, dom=templates[mydvd_path].cloneNode(True))
+    print('Converted {0} projects from {1} MyDVD files.'.format(len(rows), len({ row[2] for row in rows })))
+
+
+def _read_batch(path):
+    """ Reads the (event, project, MyDVD file, output MyDVD file) rows of a batch file, skips empty lines and lines starting with #. """
+    rows = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_number, row in enumerate(csv.reader(f), 1):
+            if not row or not ''.join(row).strip() or row[0].startswith('#'):
+                continue
+            if len(row) != 4 or not all(row):
+                raise ParseException('{0}, line {1}: expecting event,project,MyDVD file,output MyDVD file'.format(path, line_number))
+            rows.append(tuple(row))
+    if not rows:
+        raise ParseException('{0} has no projects'.format(path))
+    return rows
+
+
 def _get_fcp_project(path, event, project):
     """ Extracts FCP chapters.
         
@@ -237,26 +308,124 @@ def _get_fcp_project(path, event, project):
         print('Looking for {0}/{1}...'.format(event, project))
         print()
 
-    dom = parse(path)
-    doc = dom.documentElement
-    if doc.tagName != 'fcpxml':
-        raise ParseException('The input is not a Final Cut Pro XML file') 
     if not event:
         raise ParseException('Missing event name')
     if not project:
         raise ParseException('Missing project name')
-            
-    # for elem_lib in doc.getElementsByTagName('library'):
-    elem_lib = xmlutils.get_child_or_raise(doc, 'library', 'Cannot find a library')
-    elem_event = xmlutils.get_child_with_attr(elem_lib, 'event', 'name', event)   
-    if elem_event is None:
-        raise ParseException('Cannot find event {0}'.format(event))
-
-    elem_project = xmlutils.get_child_with_attr(elem_event, 'project', 'name', project)    
-    elem_sequence = xmlutils.get_child_or_raise(elem_project, 'sequence', 'Cannot find a sequence')    
-    
-    tc_format = xmlutils.get_attr(elem_sequence, 'tcFormat', 'NDF')
-    seq_duration = FractionalTime.from_fcp_time(xmlutils.get_attr(elem_sequence, 'duration', '0s'))
+    return _read_fcp_projects(path, [(event, project)])[(event, project)]
+
+
+def _read_fcp_projects(path, wanted):
+    """ Reads the projects from a Final Cut Pro XML file.
+
+    The file is streamed with iterparse instead of loaded in a DOM: only library/event/project/sequence/spine is looked at,
+    every other element is freed as soon as it was read and reading stops when the sequences of all the projects were read.
+    Like the DOM lookups, only the first library is searched and the first event, project, sequence and spine with a name wins.
+
+    Arguments:
+        * path -- the path to the input FCP XML file
+        * wanted -- a list of (event name, project name)
+
+    Returns:
+        A dictionary (event name, project name) -> FcpProject instance
+    """
+    global _verbose
+    wanted = set(wanted)
+    events = { event for event, _ in wanted }
+    projects = {}
+    found_events = set()
+    # The open elements from the root down: [element, role, roles of the children found]. The role is what the element
+    # is on the way to a spine, None for the elements not looked at
+    stack = []
+    # The project of the sequence being read and its frame rate
+    sequence = None
+    fps = 0
+    for kind, elem in ElementTree.iterparse(path, events=('start', 'end')):
+        if kind == 'start':
+            parent = stack[-1] if stack else None
+            role = _fcp_role(parent, elem, events, wanted)
+            if role == 'root' and elem.tag != 'fcpxml':
+                raise ParseException('The input is not a Final Cut Pro XML file')
+            if role in ('event', 'project', 'sequence', 'spine'):
+                # The first one wins
+                key = elem.get('name') if role in ('event', 'project') else role
+                if key in parent[2]:
+                    role = None
+                else:
+                    parent[2].add(key)
+            if role == 'event':
+                found_events.add(elem.get('name'))
+            elif role == 'sequence':
+                tc_format, time_base, fps = _get_fcp_format(elem)
+                sequence = FcpProject(stack[-2][0].get('name'), parent[0].get('name'), time_base, tc_format, [])
+            elif role == 'spine' and _verbose:
+                print('Looking for chapters...')
+                print()
+            stack.append([elem, role, set()])
+            continue
+
+        _, role, found = stack.pop()
+        if role == 'clip':
+            sequence.chapters.extend(_get_fcp_chapters(elem, sequence.time_base, fps))
+        elif role == 'sequence':
+            if 'spine' not in found:
+                raise ParseException('Cannot find a spine element')
+            if _verbose:
+                print()
+                for chapter in sequence.chapters:
+                    print('Chapter: Offset: {0} Name: {1}'.format(chapter.offset.to_smpte(fps), chapter.name))
+                print()
+            projects[(sequence.event, sequence.name)] = sequence
+            if len(projects) == len(wanted):
+                break
+        elif role == 'project' and 'sequence' not in found:
+            raise ParseException('Cannot find a sequence')
+        elif role == 'library':
+            # Only the first library
+            break
+        if role != 'marker':
+            # Free the element, the elements in a clip are freed with the clip
+            elem.clear()
+            if stack:
+                stack[-1][0].remove(elem)
+
+    for event, project in sorted(wanted):
+        if (event, project) in projects:
+            continue
+        if event not in found_events:
+            raise ParseException('Cannot find event {0}'.format(event))
+        raise ParseException('Cannot find project {0}'.format(project))
+    return projects
+
+
+def _fcp_role(parent, elem, events, wanted):
+    """ Returns what an element is on the way to the spine of a wanted project, None if it does not lead there. """
+    if parent is None:
+        return 'root'
+    parent_elem, parent_role, _ = parent
+    if parent_role == 'root':
+        return 'library' if elem.tag == 'library' else None
+    if parent_role == 'library':
+        return 'event' if elem.tag == 'event' and elem.get('name') in events else None
+    if parent_role == 'event':
+        return 'project' if elem.tag == 'project' and (parent_elem.get('name'), elem.get('name')) in wanted else None
+    if parent_role == 'project':
+        return 'sequence' if elem.tag == 'sequence' else None
+    if parent_role == 'sequence':
+        return 'spine' if elem.tag == 'spine' else None
+    if parent_role == 'spine':
+        return 'clip' if elem.tag in ('clip', 'asset-clip') else None
+    if parent_role in ('clip', 'marker'):
+        return 'marker'
+    return None
+
+
+def _get_fcp_format(elem_sequence):
+    """ Returns (time code format, time base, frames per second) of a sequence element.
+    """
+    global _verbose
+    tc_format = _get_fcp_attr(elem_sequence, 'tcFormat', 'NDF')
+    seq_duration = FractionalTime.from_fcp_time(_get_fcp_attr(elem_sequence, 'duration', '0s'))
     time_base = seq_duration.denominator
     # Guess the  target frames per second rate. We support only 29.97 and 30 fps
     # TODO: Better way of determining target frame rate. Where is that in FCP XML?
@@ -274,65 +443,57 @@ def _get_fcp_project(path, event, project):
         print('Frame rate                : {0}'.format(fps))
         print()
         # TODO: verify that seq_duration[1] is the base, 30000 = 29.97fps(?)
-    
-    chapters = _get_fcp_chapters(elem_sequence, time_base, fps)
-    return FcpProject(event, project, time_base, tc_format, chapters)
-    
-    
-def _get_fcp_chapters(elem_sequence, time_base, fps):
-    """ Extracts chapter information from the specified Final Cut Pro XML file.
+    return tc_format, time_base, fps
+
+
+def _get_fcp_chapters(elem_clip, time_base, fps):
+    """ Extracts the chapters of a clip element of the spine.
     """
     global _verbose
-    if _verbose:
-        print('Looking for chapters...')
-        print()
-        
     chapters = []
-    elem_spine = xmlutils.get_child_or_raise(elem_sequence, 'spine', 'Cannot find a spine element')
-    for elem_clip in xmlutils.get_children_by_names(elem_spine, ['clip', 'asset-clip']):       
-        ft_clip_offset = FractionalTime.from_fcp_time(xmlutils.get_attr(elem_clip, 'offset', '0s'))
-        ft_clip_duration = FractionalTime.from_fcp_time(xmlutils.get_attr(elem_clip, 'duration', '0s'))
-        ft_clip_start = FractionalTime.from_fcp_time(xmlutils.get_attr(elem_clip, 'start', '0s'))
-        ft_tc_format = xmlutils.get_attr(elem_clip, 'tcFormat', 'DF')
-        if _verbose:
-            print('Clip Offset: {0:} Duration: {1} Start: {2} TimeCodeFormat: {3} Name: {4}'.format(
-                ft_clip_offset.to_smpte(fps),
-                ft_clip_duration.to_smpte(fps),
-                ft_clip_start.to_smpte(fps),
-                ft_tc_format.rjust(3),
-                elem_clip.attributes['name'].value))
-                
-        for elem_chapter_marker in xmlutils.get_children_by_name(elem_clip, 'chapter-marker'):
-            chapter_name = xmlutils.get_attr(elem_chapter_marker, 'value', '')            
-            # Get chapter offset relative to the beginning of the sequence
-            ft_chapter_marker_start = FractionalTime.from_fcp_time(xmlutils.get_attr(elem_chapter_marker, 'start', '0s'))
-            # Convert FractionalTime to numbers.Fraction
-            fr = ft_clip_offset.to_fraction() - ft_clip_start.to_fraction() + ft_chapter_marker_start.to_fraction()
-            # Normalize fractional time: use time base
-            chapter_offset = FractionalTime(int(fr.numerator * time_base / fr.denominator), time_base)
-            # Append to array                    
-            chapters.append(FcpChapter(chapter_offset, chapter_name))
-               
-    if _verbose:
-        print()
-         
+    ft_clip_offset = FractionalTime.from_fcp_time(_get_fcp_attr(elem_clip, 'offset', '0s'))
+    ft_clip_duration = FractionalTime.from_fcp_time(_get_fcp_attr(elem_clip, 'duration', '0s'))
+    ft_clip_start = FractionalTime.from_fcp_time(_get_fcp_attr(elem_clip, 'start', '0s'))
+    ft_tc_format = _get_fcp_attr(elem_clip, 'tcFormat', 'DF')
     if _verbose:
-        for chapter in chapters:
-            print('Chapter: Offset: {0} Name: {1}'.format(chapter.offset.to_smpte(fps), chapter.name))
-        print()
+        print('Clip Offset: {0:} Duration: {1} Start: {2} TimeCodeFormat: {3} Name: {4}'.format(
+            ft_clip_offset.to_smpte(fps),
+            ft_clip_duration.to_smpte(fps),
+            ft_clip_start.to_smpte(fps),
+            ft_tc_format.rjust(3),
+            elem_clip.get('name')))
 
-        
+    for elem_chapter_marker in elem_clip.iterfind('chapter-marker'):
+        chapter_name = _get_fcp_attr(elem_chapter_marker, 'value', '')
+        # Get chapter offset relative to the beginning of the sequence
+        ft_chapter_marker_start = FractionalTime.from_fcp_time(_get_fcp_attr(elem_chapter_marker, 'start', '0s'))
+        # Convert FractionalTime to numbers.Fraction
+        fr = ft_clip_offset.to_fraction() - ft_clip_start.to_fraction() + ft_chapter_marker_start.to_fraction()
+        # Normalize fractional time: use time base
+        chapter_offset = FractionalTime(int(fr.numerator * time_base / fr.denominator), time_base)
+        # Append to array
+        chapters.append(FcpChapter(chapter_offset, chapter_name))
     return chapters
 
 
-def _set_mydvd_chapters(path, fcp_project, out_path):
+def _get_fcp_attr(elem, name, def_val):
+    """ Like xmlutils.get_attr() for an ElementTree element: the default value if the attribute is missing or empty. """
+    return elem.get(name) or def_val
+
+
+def _set_mydvd_chapters(path, fcp_project, out_path, dom=None):
     """ Exports the specified chapters to the specified MyDVD file.
+    The MyDVD file is parsed unless dom is already its DOM, the DOM is modified.
+    Without a DOM, the chapters are spliced into the file as is if possible, see _splice_mydvd_chapters().
     """   
     global _verbose
         
     if not fcp_project:
         raise ParseException('No project')    
-    dom = parse(path)
+    if dom is None:
+        if _splice_mydvd_chapters(path, fcp_project, out_path):
+            return
+        dom = parse(path)
     doc = dom.documentElement
     if doc.tagName != 'MDProject':
         raise ParseException('The output is not a Toast MyDVD project file') 
@@ -342,22 +503,38 @@ def _set_mydvd_chapters(path, fcp_project, out_path):
     
     # We are looking for the first title in the main menu. We do not support more than one title
     elem_title = xmlutils.get_child_or_raise(elem_main_menu_children, 'MDTitle', 'Cannot find a title')
+    # Looked up more than once
+    title = xmlutils.ElementIndex(elem_title)
 
     # We are using the thumbnail URL for creating chapter markers
-    elem_preview_thumbnail = xmlutils.get_child_or_raise(elem_title, 'previewThumbnail', 'Cannot find preview thumbnail')
+    elem_preview_thumbnail = title.get_child_or_raise('previewThumbnail', 'Cannot find preview thumbnail')
     elem_url = xmlutils.get_child_or_raise(elem_preview_thumbnail, 'url', 'Cannot find thumbnail URL')
     url = xmlutils.get_text(elem_url)
     if _verbose:
         print ('URL: {0}'.format(url))
 
 
-    elem_title_children = xmlutils.get_child_or_raise(elem_title, 'children', 'Cannot find title children') 
+    elem_title_children = title.get_child_or_raise('children', 'Cannot find title children') 
     elem_title_menu = xmlutils.get_child_or_raise(elem_title_children, 'MDMenu', 'Cannot find title menu')
     elem_title_menu_children = xmlutils.get_child_or_raise(elem_title_menu, 'children', 'Cannot find title menu children')
     
     # Remove all children of MDMenu/children
     xmlutils.remove_children(elem_title_menu_children)
+    _add_mydvd_chapters(dom, elem_title_menu_children, url, fcp_project)
+
+    with open(out_path, 'w', buffering=WRITE_BUFFER_SIZE) as out_file:
+        changed = _write_mydvd(dom, out_file)
+    if _verbose:
+        for tag in changed:
+            print('Empty tag changed from <{0}/> to <{0}></{0}>'.format(tag))
+        if changed:
+            print('')
+        print('Saved to {0}'.format(out_path))
 
+
+def _add_mydvd_chapters(dom, elem_parent, url, fcp_project):
+    """ Appends the chapters of the project to the parent element, the first one for the beginning of the movie.
+    """
     # Adds first marker for the beginning of the movie   
     count = 1
     if fcp_project.time_base != 30000:
@@ -368,7 +545,7 @@ def _set_mydvd_chapters(path, fcp_project, out_path):
         
     fps = time_scale / 1000
     # For some reason the first time_scale is multiplied by 1000
-    _add_mydvd_chapter(dom, elem_title_menu_children, url, str(count), 'Start of Movie', 0, time_scale * 1000)
+    _add_mydvd_chapter(dom, elem_parent, url, str(count), 'Start of Movie', 0, time_scale * 1000)
     
     for chapter in fcp_project.chapters:
         time_value = round(chapter.offset.numerator * time_scale / chapter.offset.denominator)
@@ -379,33 +556,166 @@ def _set_mydvd_chapters(path, fcp_project, out_path):
         # TODO: Use chapter.name or a counter?
         chapter_name = str(count)
         edit_name = str(FractionalTime(time_value, time_scale).to_smpte(fps))
-        _add_mydvd_chapter(dom, elem_title_menu_children, url, chapter_name, edit_name, time_value, time_scale)
+        _add_mydvd_chapter(dom, elem_parent, url, chapter_name, edit_name, time_value, time_scale)
 
-    xml = str(dom.toxml())
-    
-    # MyDVD quirks:
-    # 1. Does not like <tag/>, replacing <tag/> with <tag></tag>
-    tags_changed = False
-    for m in re.finditer('\<([0-9A-Za-z]+)/\>', xml):
-        if m.group(0) in xml:
-            tag_before = m.group(0)
-            tag_after = '<{0}></{0}>'.format(m.group(1))
-            xml = xml.replace(tag_before, tag_after)
-            tags_changed = True
+
+def _splice_mydvd_chapters(path, fcp_project, out_path):
+    """ Fast path of _set_mydvd_chapters(): finds the children of the title menu in the memory mapped MyDVD file, without a DOM,
+    and writes a copy of the file with only these children replaced by the chapters. Everything else is copied as is.
+    Returns False without writing anything if the file does not look as expected, then the DOM must be used.
+    """
+    global _verbose
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty
+            return False
+        with data:
+            found = _find_mydvd_title_menu_children(data)
+            if found is None:
+                if _verbose:
+                    print('Cannot splice the chapters into {0}, rewriting it'.format(path))
+                return False
+            (root_start, root_end), (thumbnail_start, thumbnail_end), (start, end) = found
+
+            # Same as the DOM path: the URL of the preview thumbnail of the title
+            elem_preview_thumbnail = parseString(data[thumbnail_start:thumbnail_end]).documentElement
+            elem_url = xmlutils.get_child_or_raise(elem_preview_thumbnail, 'url', 'Cannot find thumbnail URL')
+            url = xmlutils.get_text(elem_url)
             if _verbose:
-                print('Empty tag changed from {0} to {1}'.format(tag_before, tag_after))
-    # 2. Does not like a new line at the end of the file    
-    xml = xml.rstrip('\n')
-    if tags_changed:
-        if _verbose:
-            print('')
-    
-    with open(out_path, 'w') as out_file:
-        print(xml, file=out_file)
+                print ('URL: {0}'.format(url))
+
+            # The chapters are built and written like in the DOM path, in a document of their own
+            dom = Document()
+            elem_children = dom.createElement('children')
+            _add_mydvd_chapters(dom, elem_children, url, fcp_project)
+            chapters = io.StringIO()
+            for elem_chapter in elem_children.childNodes:
+                _write_mydvd_node(elem_chapter, chapters, {})
+
+            # The output may be the input: write another file and replace
+            tmp_path = out_path + '.tmp'
+            try:
+                with open(tmp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as out_file, memoryview(data) as view:
+                    # Framed like the DOM path: its XML declaration, the root element and one new line
+                    out_file.write(b'<?xml version="1.0" ?>')
+                    out_file.write(view[root_start:start])
+                    out_file.write(chapters.getvalue().encode('utf-8'))
+                    out_file.write(view[end:root_end])
+                    out_file.write(b'\n')
+                os.replace(tmp_path, out_path)
+            except OSError:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
     if _verbose:
         print('Saved to {0}'.format(out_path))
- 
- 
+    return True
+
+
+def _find_mydvd_title_menu_children(data):
+    """ Scans the tags of a MyDVD file for the first title like the DOM path does.
+    Returns ((start, end) of the root element, (start, end) of the preview thumbnail of the title, (start, end) of the content
+    of the children of the title menu) or None if not found, if the file is not well formed, if it has <tag/>, which must be
+    rewritten for MyDVD, or if there is more than the XML declaration and white space around the root element.
+    """
+    if data.find(b'/>') >= 0:
+        return None
+    # Open tags
+    stack = []
+    # How many of the open tags are on the path to the title menu children
+    matched = 0
+    root_start = content_start = thumbnail_start = None
+    children = thumbnail = None
+    for m in _XML_TOKEN.finditer(data):
+        tag = m.group(2)
+        if tag is None:
+            # Comment, declaration...
+            continue
+        if not m.group(1):
+            stack.append(tag)
+            depth = len(stack)
+            if depth == 1:
+                if tag != _TITLE_MENU_CHILDREN[0] or root_start is not None or not _PROLOG.match(data, 0, m.start()):
+                    return None
+                root_start = m.start()
+            if children is None and matched < len(_TITLE_MENU_CHILDREN) and depth == matched + 1 and tag == _TITLE_MENU_CHILDREN[matched]:
+                matched += 1
+                if matched == len(_TITLE_MENU_CHILDREN):
+                    content_start = m.end()
+            elif depth == _TITLE_DEPTH + 1 and matched == _TITLE_DEPTH and tag == b'previewThumbnail' and thumbnail_start is None:
+                thumbnail_start = m.start()
+            continue
+        if not stack or stack.pop() != tag:
+            return None
+        depth = len(stack) + 1
+        if depth == matched:
+            if matched == len(_TITLE_MENU_CHILDREN):
+                children = (content_start, m.start())
+            elif children is None:
+                # The first element with the name on the path has no title menu children, the DOM path reports it
+                return None
+            matched -= 1
+            if matched < _TITLE_DEPTH and thumbnail is None:
+                # The title has no preview thumbnail
+                return None
+        elif depth == _TITLE_DEPTH + 1 and thumbnail_start is not None and thumbnail is None:
+            thumbnail = (thumbnail_start, m.end())
+        if children is not None and thumbnail is not None:
+            break
+    else:
+        return None
+    # The rest is not scanned: the root must end the file
+    end_tag = b'</' + _TITLE_MENU_CHILDREN[0] + b'>'
+    root_end = data.rfind(end_tag)
+    if root_end < children[1] or data[root_end + len(end_tag):].strip():
+        return None
+    return (root_start, root_end + len(end_tag)), thumbnail, children
+
+
+def _write_mydvd(dom, out_file):
+    """ Writes the DOM like toxml() with the MyDVD quirks, element by element instead of building the document as a string.
+    MyDVD does not like <tag/>: empty elements without attributes are written as <tag></tag>. The file ends with one new line.
+    Returns the names of the empty tags written the MyDVD way, in the order found.
+    """
+    out_file.write('<?xml version="1.0" ?>')
+    changed = collections.OrderedDict()
+    for node in dom.childNodes:
+        _write_mydvd_node(node, out_file, changed)
+    out_file.write('\n')
+    return list(changed)
+
+
+def _write_mydvd_node(node, out_file, changed):
+    """ Writes a node and its children, see _write_mydvd(). """
+    if node.nodeType != Node.ELEMENT_NODE:
+        # Text, comments... written by the DOM
+        node.writexml(out_file)
+        return
+    out_file.write('<' + node.tagName)
+    attrs = node.attributes
+    for name in attrs.keys():
+        out_file.write(' {0}="{1}"'.format(name, _escape(attrs[name].value)))
+    if node.childNodes:
+        out_file.write('>')
+        for child in node.childNodes:
+            _write_mydvd_node(child, out_file, changed)
+        out_file.write('</{0}>'.format(node.tagName))
+    elif not attrs.length and _EMPTY_TAG.match(node.tagName):
+        out_file.write('></{0}>'.format(node.tagName))
+        changed[node.tagName] = True
+    else:
+        out_file.write('/>')
+
+
+def _escape(data):
+    """ Escapes an attribute value like the DOM does. """
+    return data.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+
 def _add_mydvd_chapter(dom, elem_parent, url, chapter_name, edit_name, time_value, time_scale):
     """ Arguments:
         * dom -- the DOM
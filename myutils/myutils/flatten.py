@@ -9,10 +9,23 @@ Created on Jun 30, 2016
 
 @author: Florin Rosca
 """
-import sys, os, getopt, math, shutil
+import sys, os, getopt, time, json, collections
+
+if __package__:
+    from . import sniff, fastcopy, timings, dedupe, scanner
+else:
+    # Run as a script
+    import sniff, fastcopy, timings, dedupe, scanner
 
 
 SCRIPT = os.path.basename(__file__)
+MB = 1024 * 1024
+# Copies submitted but not finished, per thread: enough to keep the threads busy without a future for each file of a huge tree
+COPIES_PER_THREAD = 4
+# Records which input file goes to which output file and which copies finished, in the output directory
+JOURNAL = ".flatten.journal"
+# The files to copy: not hidden, named .jpg and JPEG inside, do not trust the extension
+ACCEPT = scanner.all_of(scanner.not_hidden, scanner.extension(".jpg"), scanner.mime_type(sniff.JPEG))
 
 
 class ValidationException(Exception):
@@ -25,10 +38,14 @@ def main(argv):
     """ Main method """
     input_dir = ""
     output_dir = ""
+    jobs = 1
+    skip_duplicates = False
+    link = False
+    io_limit = 0
     try:
         if len(argv) == 0:
             raise getopt.GetoptError("Must have at least one argument") 
-        opts, _ = getopt.getopt(argv, "hi:o:", ["help", "in=", "out="])
+        opts, _ = getopt.getopt(argv, "hi:o:j:dl", ["help", "in=", "out=", "jobs=", "dedupe", "link", "io-limit="])
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 raise getopt.GetoptError("Help") 
@@ -36,22 +53,49 @@ def main(argv):
                 input_dir = arg
             elif opt in ("-o", "--out"):
                 output_dir = arg
-        flatten(input_dir, output_dir)
+            elif opt in ("-j", "--jobs"):
+                jobs = _parse_int(arg, "jobs")
+            elif opt in ("-d", "--dedupe"):
+                skip_duplicates = True
+            elif opt in ("-l", "--link"):
+                link = True
+            elif opt == "--io-limit":
+                io_limit = _parse_int(arg, "I/O limit")
+        flatten(input_dir, output_dir, jobs=jobs, skip_duplicates=skip_duplicates, link=link, io_limit=io_limit)
     except getopt.GetoptError:
         print("USAGE: {0} <options>".format(SCRIPT))
         print("")
         print("OPTIONS:")
         print("   -i <directory>        The input directory")
         print("   -o <directory>        The output directory")
+        print("   -j <number>           The number of files copied in parallel, default 1, 0 for the default of the thread pool")
+        print("   -d                    Copy files with the same content only once")
+        print("   -l                    Make hard links instead of copies when the input and the output are on the same file system")
         print("   -h                    Show help")
         print("   --in=<directory>      The input directory")
         print("   --out=<directory>     The output directory")
+        print("   --jobs=<number>       The number of files copied in parallel, default 1, 0 for the default of the thread pool")
+        print("   --dedupe              Copy files with the same content only once")
+        print("   --link                Make hard links instead of copies when the input and the output are on the same file system")
+        print("   --io-limit=<number>   Look up this many files at once, for network file systems, default 0: one at a time")
+        print("                         Set MYUTILS_IO_LATENCY=<ms> to add latency to each lookup, for testing")
         print("   --help                Show help")
         sys.exit(1)
     except ValidationException as ex:
         print("ERROR: {0}".format("".join(ex.args)))
         sys.exit(2)
         
+        
+def _parse_int(value, name):
+    """ Parses a non-negative integer option, throws a ValidationException if invalid. """
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    if number < 0:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    return number
+        
          
 def _validate(input_dir, output_dir):
     """ Validates input and output directories, throws a ValidateException if invalid. """
@@ -63,61 +107,360 @@ def _validate(input_dir, output_dir):
         raise ValidationException("'{0}' does not exist.".format(input_dir))
     
     
-def _accept(dir_, file):
-    """ Returns True if the file should be processed, False if not. """
-    if file.startswith("."):
-        return False
-    if not file.lower().endswith(".jpg"):
-        return False
-    return True
-    
+def flatten(input_dir, output_dir, jobs=1, skip_duplicates=False, link=False, io_limit=0):
+    """ Walks input directory once, creates output directory if needed, copies the files using jobs threads (0 for the default of the thread pool).
+    If skip_duplicates is True, files with the same content are copied once. If link is True, outputs are hard links to the inputs when possible.
+    If io_limit is not 0, up to io_limit files are stat'ed at once, see metaio.
     
-def flatten(input_dir, output_dir):
-    """ Walks input directory, creates output directory if needed """
+    The output names are recorded in a journal in the output directory before copying and each copy is recorded when finished,
+    so an interrupted run resumes with the same names and skips the finished files without reading them again.
+    """
     _validate(input_dir, output_dir)
-    count = { "dirs": 0, "files": 0, "moved": 0 }
+    count = { "dirs": 0, "files": 0, "moved": 0, "duplicates": 0 }
+    journal_path = os.path.join(output_dir, JOURNAL)
+    assigned, duplicate_of, done, hashed = _load_journal(journal_path)
+    if assigned or duplicate_of:
+        print("Resuming: {0} files in {1}".format(len(assigned) + len(duplicate_of), journal_path))
+    
+    # The files in the journal were accepted before, no need to read them again
+    known = { os.path.normpath(os.path.join(input_dir, source)) for source in list(assigned) + list(duplicate_of) }
+    plan = _plan(input_dir, count, known)
+    sources = { path: os.path.normpath(os.path.relpath(path, input_dir)) for path in plan }
+    stats = _stat_all(plan, io_limit)
+    saved = 0
+    for path in plan:
+        if sources[path] in duplicate_of:
+            print("{0} = {1}".format(path, os.path.join(input_dir, duplicate_of[sources[path]])))
+            count["duplicates"] += 1
+            saved += max(0, _size(stats[path]))
+    new = [path for path in plan if sources[path] not in assigned and sources[path] not in duplicate_of]
+    duplicates = {}
+    hash_records = []
+    if skip_duplicates and new:
+        new, duplicates, new_saved, hash_records = _skip_duplicates([path for path in plan if sources[path] in assigned], new, count,
+                                                                    stats, sources, hashed)
+        saved += new_saved
+    plan = [path for path in plan if sources[path] in assigned] + new
+    plan.sort(key=lambda path: int(os.path.splitext(assigned[sources[path]]["output"])[0]) if sources[path] in assigned else sys.maxsize)
+    count["files"] = len(plan)
     
-    # Count files to copy to determine number of padding zeros
-    for dirpath, _, files in os.walk(input_dir):
-        if os.path.samefile(input_dir, dirpath):
-            continue
-        for file in files:
-            if not _accept(dirpath, file):
-                continue
-            count["files"] += 1
+    # The number of files to copy determines the number of padding zeros, unless a previous run already chose the names
     print("Count: {0}".format(count["files"]))  
-    zeros = int(math.ceil(math.log10(count["files"])))
+    zeros = min(len(os.path.splitext(r["output"])[0]) for r in assigned.values()) if assigned else len(str(count["files"]))
     print("Zeros: {0}".format(zeros))   
 
     if not os.path.exists(output_dir):
         print("{0} does not exist, creating...".format(output_dir))
         os.makedirs(output_dir)
-            
-    # Copy files under output root with new name   
-    i = 0 
-    for dirpath, _, files in os.walk(input_dir):
-        count["dirs"] += 1
-        for file in files:
-            if not _accept(dirpath, file):
-                continue
-            
-            inputpath = os.path.join(dirpath, file)
-            _, inputext = os.path.splitext(inputpath)
-            i += 1
-            outputfile = str(i).zfill(zeros) + inputext 
-            outputpath= os.path.join(output_dir, outputfile)
+    
+    with _open_journal(journal_path) as journal:
+        # Record the new names before copying anything, new files are numbered after the ones in the journal
+        records = hash_records
+        number = max((int(os.path.splitext(r["output"])[0]) for r in assigned.values()), default=0)
+        # Outputs not written by a run with a journal that are copies of new files: same size and time
+        adopted = set()
+        existing = _names(output_dir)
+        for path in new:
+            _, inputext = os.path.splitext(path)
+            while True:
+                number += 1
+                output = str(number).zfill(zeros) + inputext
+                if output not in existing:
+                    break
+                if _same_file(stats[path], _stat(os.path.join(output_dir, output))):
+                    adopted.add(output)
+                    break
+                # Never paired with another file, never overwritten
+                print("{0} exists and is not a copy of {1}, skipping the number".format(os.path.join(output_dir, output), path))
+            assigned[sources[path]] = _stat_record(stats[path], output)
+            records.append(dict(source=sources[path], **assigned[sources[path]]))
+        records += [{ "source": sources[d], "duplicate_of": sources[o] } for d, o in duplicates.items()]
+        _append(journal, records, sync=True)
+        
+        # Copy files under output root with new name   
+        copies = []
+        fresh = set(new)
+        outputs = _stat_all([os.path.join(output_dir, assigned[sources[path]]["output"]) for path in plan], io_limit)
+        for inputpath in plan:
+            record = assigned[sources[inputpath]]
+            outputpath = os.path.join(output_dir, record["output"])
             print("{0} -> {1}".format(inputpath, outputpath))
-            if os.path.exists(outputpath):
-                print("Already exists")
-                continue
-            
-            shutil.copy2(inputpath, outputpath)
-            count["moved"] += 1
+            if inputpath in fresh:
+                if record["output"] in adopted:
+                    print("Already exists")
+                    _append(journal, [{ "done": record["output"] }])
+                    continue
+            elif record["output"] in done and outputs[outputpath] is not None:
+                current = _stat_record(stats[inputpath], record["output"])
+                if current == record:
+                    print("Already done")
+                    continue
+                # Changed since copied, copy again under the same name
+                _append(journal, [dict(source=sources[inputpath], **current)])
+            copies.append((inputpath, outputpath))
+        stats = _copy_all(copies, jobs, link, count, lambda outputpath: _append(journal, [{ "done": os.path.basename(outputpath) }]))
 
     print("{0} directories, {1} files, {2} files moved.".format(count["dirs"], count["files"], count["moved"])) 
+    if stats:
+        _print_stats(*stats)
+        saved += sum(size for method, size, _ in stats[1] if method == fastcopy.HARDLINK)
+    if skip_duplicates or link:
+        print("Saved {0:.1f} MB: {1} duplicates skipped, {2} hard links.".format(
+            saved / MB, count["duplicates"], stats[2][fastcopy.HARDLINK] if stats else 0))
     print("Done.")
 
 
+def _load_journal(path):
+    """ Reads the journal, returns (source -> output record, duplicate source -> original source, set of outputs copied,
+    source -> hashes record). Later records replace earlier ones. A line cut short by a crash is ignored. """
+    assigned = {}
+    duplicate_of = {}
+    done = set()
+    hashed = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "done" in record:
+                    done.add(record["done"])
+                elif "hashed" in record:
+                    hashed[record["hashed"]] = record
+                elif "duplicate_of" in record:
+                    duplicate_of[record["source"]] = record["duplicate_of"]
+                else:
+                    source = record.pop("source")
+                    assigned[source] = record
+                    # A new assignment means the file must be copied again
+                    done.discard(record["output"])
+    except FileNotFoundError:
+        pass
+    return assigned, duplicate_of, done, hashed
+
+
+def _open_journal(path):
+    """ Opens the journal for appending. """
+    # A crash may have left half a line, start on a new one
+    try:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+    except OSError:
+        torn = False
+    journal = open(path, "a", encoding="utf-8")
+    if torn:
+        journal.write("\n")
+    return journal
+
+
+def _append(journal, records, sync=False):
+    """ Appends records to the journal. Flushed so a crash of the process loses nothing, synced to the disk if sync is True. """
+    if not records:
+        return
+    for record in records:
+        journal.write(json.dumps(record) + "\n")
+    journal.flush()
+    if sync:
+        os.fsync(journal.fileno())
+
+
+def _stat_all(paths, io_limit=0):
+    """ Returns path -> os.stat() result, None if the file cannot be stat'ed.
+    One at a time if io_limit is 0, else up to io_limit at once: on a network file system each stat waits for the server. """
+    if not io_limit:
+        return { path: _stat(path) for path in paths }
+    # Imports asyncio, not needed when starting
+    if __package__:
+        from . import metaio
+    else:
+        import metaio
+    fs = metaio.default_fs()
+    results = metaio.run((metaio.Operation(fs.stat, (path,)) for path in paths), io_limit)
+    return { path: result for path, (result, _) in zip(paths, results) }
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _stat_record(st, output):
+    """ Returns the journal record of a source from its stat result, the size and time tell if it changed since. """
+    if st is None:
+        # Copying will report it
+        return { "output": output, "size": -1, "mtime_ns": 0 }
+    return { "output": output, "size": st.st_size, "mtime_ns": st.st_mtime_ns }
+
+
+def _same_file(st, output_st):
+    """ Returns True if an output has the size and the modification time of the source, copies and links keep both. """
+    return st is not None and output_st is not None and (st.st_size, st.st_mtime_ns) == (output_st.st_size, output_st.st_mtime_ns)
+
+
+def _names(dir_):
+    """ Returns the names of the files in a directory, an empty set if it cannot be listed, for example because it does not exist yet. """
+    try:
+        return set(os.listdir(dir_))
+    except OSError:
+        return set()
+
+
+def _size(st):
+    """ Returns the size of a file from its stat result, -1 if it cannot be read. """
+    return st.st_size if st is not None else -1
+
+
+def _skip_duplicates(old, new, count, stats, sources, hashed):
+    """ Returns the new files without the files with the same content as an earlier file, the duplicates (duplicate -> original),
+    the number of bytes not copied and the journal records of the hashes computed. The old files were copied before and come
+    first, so a new file with the same content is a duplicate of an old one. stats maps the paths to their stat results and
+    sources to their paths relative to the input directory.
+
+    Compared in stages like dedupe.find_duplicates(): only files with the size of a new file are read, first their leading chunk,
+    then the whole file if another one has the same leading chunk. A hash recorded in the journal (hashed: source -> record)
+    is used while the file keeps its size and time, so a finished file is read at most once.
+    """
+    new_paths = set(new)
+    # Path -> journal record of the hashes computed now
+    records = collections.OrderedDict()
+
+    def head(path):
+        """ Returns the hashes record of a file with the hash of the leading chunk, None if it cannot be read. """
+        st = stats[path]
+        record = records.get(path) or hashed.get(sources[path])
+        if record is not None and (record["size"], record["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+            return record
+        try:
+            records[path] = { "hashed": sources[path], "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                              "head": dedupe.head_hash(path), "hash": None }
+        except OSError:
+            return None
+        return records[path]
+
+    def full(path):
+        """ Returns the hash of the whole content of a file, None if it cannot be read. """
+        record = head(path)
+        if record["hash"] is None:
+            try:
+                # The leading chunk is the whole file
+                value = record["head"] if record["size"] <= dedupe.CHUNK_SIZE else dedupe.content_hash(path)
+            except OSError:
+                return None
+            records[path] = dict(record, hash=value)
+        return records.get(path, record)["hash"]
+
+    def groups(paths, key):
+        """ Generates the groups of paths with the same key, in the order of the paths, with at least one new file among others. """
+        by_key = collections.OrderedDict()
+        for path in paths:
+            value = key(path)
+            if value is not None:
+                by_key.setdefault(value, []).append(path)
+        for group in by_key.values():
+            if len(group) > 1 and any(path in new_paths for path in group):
+                yield group
+
+    duplicates = {}
+    for same_size in groups(old + new, lambda path: _size(stats[path]) if stats[path] is not None else None):
+        for same_head in groups(same_size, lambda path: (head(path) or {}).get("head")):
+            for same in groups(same_head, full):
+                for path in same[1:]:
+                    if path in new_paths:
+                        duplicates[path] = same[0]
+    for path in new:
+        if path in duplicates:
+            print("{0} = {1}".format(path, duplicates[path]))
+    count["duplicates"] += len(duplicates)
+    return ([path for path in new if path not in duplicates], duplicates, sum(_size(stats[path]) for path in duplicates),
+            list(records.values()))
+
+
+def _copy_all(copies, jobs, link, count, on_done):
+    """ Copies the (input path, output path) pairs in parallel, the kernel does the copying so threads are enough.
+    Calls on_done(output path) after each successful copy.
+    Returns (seconds, list of (copy method, bytes, seconds) per file, count of copy methods) or None if nothing was copied. """
+    if not copies:
+        return None
+    import concurrent.futures
+    start = time.perf_counter()
+    files = []
+    methods = collections.Counter()
+
+    def finish(inputpath, outputpath, future):
+        try:
+            method, size, seconds = future.result()
+        except OSError as ex:
+            print("ERROR: {0}: {1}".format(inputpath, ex))
+            return
+        on_done(outputpath)
+        methods[method] += 1
+        files.append((method, size, seconds))
+        count["moved"] += 1
+
+    # The default of the thread pool when jobs is 0
+    threads = jobs or min(32, (os.cpu_count() or 1) + 4)
+    # (input path, output path, future) in the order of the copies
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        for inputpath, outputpath in copies:
+            if len(pending) >= threads * COPIES_PER_THREAD:
+                finish(*pending.popleft())
+            pending.append((inputpath, outputpath, executor.submit(_copy, inputpath, outputpath, link)))
+        while pending:
+            finish(*pending.popleft())
+    return time.perf_counter() - start, files, methods
+
+
+def _copy(inputpath, outputpath, link):
+    """ Copies or links one file with its metadata, returns (copy method, bytes, seconds).
+    Writes to a temporary name and renames, so the output name never holds a partial file. """
+    start = time.perf_counter()
+    dir_, name = os.path.split(outputpath)
+    temp_path = os.path.join(dir_, "." + name + ".tmp")
+    try:
+        # Left over by a crash
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        method = fastcopy.link_or_copy2(inputpath, temp_path) if link else fastcopy.copy2(inputpath, temp_path)
+        os.replace(temp_path, outputpath)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return method, os.path.getsize(outputpath), time.perf_counter() - start
+
+
+def _print_stats(seconds, files, methods):
+    """ Prints the total and per-file copy throughput, hard links copy nothing and are left out. """
+    files = [(s, t) for method, s, t in files if method != fastcopy.HARDLINK]
+    if not files:
+        return
+    size = sum(s for s, _ in files)
+    print("Copied {0:.1f} MB in {1:.2f}s, {2:.1f} MB/s ({3}).".format(
+        size / MB, seconds, size / MB / seconds if seconds else 0, ", ".join("{0}: {1}".format(k, v) for k, v in methods.most_common())))
+    # Throughput of each file, tiny files are mostly open/close and say little about the disk
+    rates = sorted(s / MB / t for s, t in files if t > 0)
+    if rates:
+        print("Per file: median {0:.1f} MB/s, slowest 5% below {1:.1f} MB/s.".format(timings.percentile(rates, 50), timings.percentile(rates, 5)))
+
+
+def _plan(input_dir, count, known=()):
+    """ Returns the paths of the files to copy, in the same order as os.walk(): the files in a directory, then each sub-directory. 
+    Paths in known are accepted without checking. No index: the numbers depend on all the files, not only the new ones.
+    """
+    known_filter = lambda entry: os.path.normpath(entry.path) in known
+    files = scanner.Scanner(input_dir, filters=(scanner.any_of(known_filter, ACCEPT),))
+    plan = [entry.path for entry in files]
+    count["dirs"] += files.dirs
+    return plan
+
+
 if __name__ == "__main__":
     main(sys.argv[1:])
 
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Watches a directory for file system events with the Linux inotify API, through ctypes so nothing needs to be installed.
+ctypes and the C library are loaded only when a directory is watched.
+Waiting for events does not use the CPU: the process sleeps in poll() until the kernel has events or the timeout expires.
+"""
+
+import sys, os, errno, math, select, struct
+
+# Events, from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+# Always reported
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+# struct inotify_event: watch descriptor, mask, cookie, length of the name that follows
+_EVENT = struct.Struct("iIII")
+# Enough for hundreds of events at once
+BUFFER_SIZE = 64 * 1024
+
+# The C library: None until needed, False if it has no inotify
+_libc = None
+
+
+def available():
+    """ Returns True if inotify can be used on this system. """
+    return bool(_load())
+
+
+def _load():
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith("linux"):
+            try:
+                import ctypes, ctypes.util
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                if hasattr(libc, "inotify_init1") and hasattr(libc, "inotify_add_watch"):
+                    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                    _libc = libc
+            except OSError:
+                pass
+    return _libc
+
+
+def _error(path=None):
+    import ctypes
+    e = ctypes.get_errno()
+    return OSError(e, os.strerror(e), path)
+
+
+class Watcher(object):
+    """ Watches one directory.
+
+    Arguments:
+        * path -- the directory
+        * mask -- the events to report, IN_* flags
+    """
+
+    def __init__(self, path, mask):
+        libc = _load()
+        if not libc:
+            raise OSError(errno.ENOSYS, "inotify is not available", path)
+        self.path = path
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise _error(path)
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            error = _error(path)
+            os.close(self.fd)
+            raise error
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+
+    def read(self, timeout=None):
+        """ Waits up to timeout seconds, forever if None, returns a list of (mask, file name), empty if the timeout expired. """
+        if not self._poll.poll(None if timeout is None else int(math.ceil(timeout * 1000))):
+            return []
+        try:
+            data = os.read(self.fd, BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            # The name is padded with zeros
+            events.append((mask, os.fsdecode(data[pos:pos + length].rstrip(b"\x00"))))
+            pos += length
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    with Watcher(sys.argv[1] if len(sys.argv) > 1 else ".", IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) as watcher:
+        while True:
+            for mask, name in watcher.read():
+                print("{0:08x} {1}".format(mask, name))
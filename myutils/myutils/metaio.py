@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+Runs file system metadata operations (stat, mkdir, rename...) concurrently. On network file systems (SMB, NFS) each
+operation waits for a round trip to the server; running many at once hides the latency. An asyncio loop schedules
+the operations on a bounded pool of threads, with at most a given number in flight.
+
+Operations with the same key run one after the other, in the order given, and an operation can wait for earlier ones,
+for example renames into a directory wait for the mkdir of the directory.
+
+Set MYUTILS_IO_LATENCY to a number of milliseconds to add that latency to each operation, to try it on a local disk.
+"""
+
+import sys, os, time, asyncio, functools, collections
+
+# The default number of operations in flight
+DEFAULT_LIMIT = 32
+# Milliseconds of latency added to each operation, for testing
+LATENCY_ENV = "MYUTILS_IO_LATENCY"
+
+# What to run: fn(*args). Operations with the same key (not None) run in order, after lists the indexes of earlier operations to wait for
+Operation = collections.namedtuple("Operation", "fn args key after", defaults=(None, ()))
+
+
+class LocalFS(object):
+    """ The metadata operations, as the os module does them. """
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def mkdir(self, path):
+        """ Creates the directory and its parents, does nothing if it exists. """
+        os.makedirs(path, exist_ok=True)
+
+    def rename(self, src, dst):
+        os.rename(src, dst)
+
+    def unlink(self, path):
+        os.unlink(path)
+
+
+class LatencyFS(LocalFS):
+    """ Waits before each operation, like a file system far away. """
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def stat(self, path):
+        time.sleep(self.latency)
+        return LocalFS.stat(self, path)
+
+    def mkdir(self, path):
+        time.sleep(self.latency)
+        LocalFS.mkdir(self, path)
+
+    def rename(self, src, dst):
+        time.sleep(self.latency)
+        LocalFS.rename(self, src, dst)
+
+    def unlink(self, path):
+        time.sleep(self.latency)
+        LocalFS.unlink(self, path)
+
+
+def default_fs():
+    """ Returns a LatencyFS if MYUTILS_IO_LATENCY is set, a LocalFS otherwise. """
+    latency = os.environ.get(LATENCY_ENV)
+    return LatencyFS(float(latency) / 1000) if latency else LocalFS()
+
+
+def run(operations, limit=DEFAULT_LIMIT):
+    """ Runs the operations with at most limit in flight. Returns a list of (result, exception), one per operation, in order. """
+    operations = list(operations)
+    if not operations:
+        return []
+    return asyncio.run(_run(operations, max(1, limit)))
+
+
+async def _run(operations, limit):
+    import concurrent.futures
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=limit) as executor:
+        semaphore = asyncio.Semaphore(limit)
+        tasks = []
+        # Key -> the last operation with the key
+        last = {}
+        for op in operations:
+            waits = [tasks[i] for i in op.after]
+            if op.key is not None and op.key in last:
+                waits.append(last[op.key])
+            task = asyncio.ensure_future(_one(loop, executor, semaphore, op, waits))
+            if op.key is not None:
+                last[op.key] = task
+            tasks.append(task)
+        return await asyncio.gather(*tasks)
+
+
+async def _one(loop, executor, semaphore, op, waits):
+    if waits:
+        # Wait for them to finish, failed or not
+        await asyncio.wait(waits)
+    async with semaphore:
+        try:
+            return await loop.run_in_executor(executor, functools.partial(op.fn, *op.args)), None
+        except Exception as ex:
+            return None, ex
+
+
+if __name__ == "__main__":
+    # Compares stat'ing the files of a directory one at a time and concurrently: metaio.py <directory> [latency in ms] [limit]
+    top = sys.argv[1] if len(sys.argv) > 1 else "."
+    fs = LatencyFS(float(sys.argv[2]) / 1000) if len(sys.argv) > 2 else default_fs()
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_LIMIT
+    paths = [entry.path for entry in os.scandir(top)]
+    for n in (1, limit):
+        start = time.perf_counter()
+        results = run((Operation(fs.stat, (path,)) for path in paths), n)
+        print("{0} files, {1} in flight: {2:.3f}s, {3} failed".format(len(paths), n, time.perf_counter() - start, sum(1 for _, ex in results if ex)))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+A staged pipeline: one reader thread, worker threads and one writer thread connected by bounded queues.
+The reader prefetches while the workers use the CPU and the writer flushes, so the disk and the CPU are busy at the same time.
+
+The number of items waiting between stages is limited by the queue depth and the number of bytes held by the
+items in flight is limited by a memory budget. Results are returned in the order of the input.
+"""
+
+import threading, queue
+
+MB = 1024 * 1024
+
+# Tells a stage there are no more items
+_DONE = object()
+# Seconds a stage waits on a queue or on the budget before checking whether the pipeline was stopped
+POLL_SECONDS = 0.1
+
+
+class Budget(object):
+    """ Limits the number of bytes in flight. One item is always admitted, even if larger than the budget, otherwise it would wait forever. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size, stop=None):
+        """ Waits until size bytes fit in the budget. Returns False without acquiring anything if the stop event is set while waiting. """
+        with self._cond:
+            while self.used > 0 and self.used + size > self.max_bytes:
+                if stop is not None and stop.is_set():
+                    return False
+                self._cond.wait(POLL_SECONDS if stop is not None else None)
+            self.used += size
+        return True
+
+    def release(self, size):
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+
+class Pipeline(object):
+    """ Runs read -> process -> write for each item.
+
+    Arguments:
+        * read -- read(item) returns (data, size in bytes), runs in the reader thread
+        * process -- process(item, data) returns (data, size in bytes), runs in one of the worker threads
+        * write -- write(item, data) returns the result for the item, runs in the writer thread
+        * workers -- the number of worker threads
+        * depth -- the maximum number of items waiting in each queue
+        * max_bytes -- the maximum number of bytes held by the items in flight
+
+    If a stage raises an exception, the item skips the remaining stages and the exception is returned as its error.
+    """
+
+    def __init__(self, read, process, write, workers=1, depth=4, max_bytes=256 * MB):
+        assert workers > 0 and depth > 0
+        self._read = read
+        self._process = process
+        self._write = write
+        self.workers = workers
+        self._read_queue = queue.Queue(maxsize=depth)
+        self._write_queue = queue.Queue(maxsize=depth)
+        self._done_queue = queue.Queue()
+        self._budget = Budget(max_bytes)
+        self._stop = threading.Event()
+        self._error = None
+
+    def run(self, items):
+        """ Generates (item, result, error) in the order of items, error is None if all stages succeeded.
+        When the caller stops early, closing the generator, the stages stop after the item they are busy with and their threads are joined. """
+        threads = [threading.Thread(target=self._reader, args=(items,), daemon=True)]
+        threads += [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        threads.append(threading.Thread(target=self._writer, daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            # Items finish out of order, keep the early ones until it is their turn
+            pending = {}
+            next_seq = 0
+            while True:
+                done = self._done_queue.get()
+                if done is _DONE:
+                    break
+                pending[done[0]] = done[1:]
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _put(self, q, value):
+        """ Puts a value in a bounded queue, gives up if the pipeline was stopped. """
+        while not self._stop.is_set():
+            try:
+                q.put(value, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """ Gets a value from a queue, _DONE if the pipeline was stopped. """
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _reader(self, items):
+        try:
+            for seq, item in enumerate(items):
+                if self._stop.is_set():
+                    return
+                try:
+                    data, size = self._read(item)
+                except Exception as ex:
+                    self._done_queue.put((seq, item, None, ex))
+                    continue
+                if not self._budget.acquire(size, self._stop):
+                    return
+                if not self._put(self._read_queue, (seq, item, data, size)):
+                    return
+        except Exception as ex:
+            # Iterating the items failed, there is no item to attach the error to
+            self._error = ex
+        finally:
+            for _ in range(self.workers):
+                self._put(self._read_queue, _DONE)
+
+    def _worker(self):
+        while True:
+            work = self._get(self._read_queue)
+            if work is _DONE:
+                self._put(self._write_queue, _DONE)
+                return
+            seq, item, data, size = work
+            try:
+                data, out_size = self._process(item, data)
+            except Exception as ex:
+                self._budget.release(size)
+                self._done_queue.put((seq, item, None, ex))
+                continue
+            # The input is not needed anymore, the output is held until written
+            self._budget.release(size - out_size)
+            if not self._put(self._write_queue, (seq, item, data, out_size)):
+                return
+
+    def _writer(self):
+        workers = self.workers
+        while workers > 0:
+            work = self._get(self._write_queue)
+            if work is _DONE:
+                workers -= 1
+                continue
+            seq, item, data, size = work
+            try:
+                result = self._write(item, data)
+                error = None
+            except Exception as ex:
+                result = None
+                error = ex
+            self._budget.release(size)
+            self._done_queue.put((seq, item, result, error))
+        self._done_queue.put(_DONE)
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
 """
-Resizes JPEG pictures to fit on a HDTV (1920x1080). Requires ImageMagick, Wand and libmagic.
+Resizes JPEG pictures to fit on a HDTV (1920x1080). Requires ImageMagick and Wand, uses libmagic if installed.
+Can also produce several renditions (HDTV, UHD, thumbnail) from one decode, each in its own output tree.
 
 TODO: Support any picture type: JPEG, PNG etc.
-TODO: Specify TV size: HD, UHD
 TODO: Specify diagonal size in inches -> calculate DPI
 TODO: Flag for force delete existing pictures in out directory
 
@@ -13,13 +13,37 @@ Created on Jun 21, 2016
 @author: Florin Rosca
 """
 
-import re, math, collections, sys, getopt, os, magic
-from wand.image import Image
+import math, collections, sys, getopt, os, io, json, time, hashlib, contextlib
+
+if __package__:
+    from . import sniff, pipeline, timings, dedupe, scanner
+else:
+    # Run as a script
+    import sniff, pipeline, timings, dedupe, scanner
 
 Size = collections.namedtuple("Size", "width height")
 
 SIZE = Size(1920, 1080)
+# Rendition profiles: name -> size. Each rendition goes to a sub-directory of the output directory named after the profile
+RENDITIONS = { "uhd": Size(3840, 2160), "hdtv": SIZE, "thumb": Size(320, 180) }
 RESOLUTION = Size(48, 48)
+# Sharpen parameters found somewhere here: http://www.imagemagick.org/Usage/blur/#sharpen
+UNSHARP = { "radius": 2, "sigma": 1, "amount": 0.8, "threshold": 0.016 }
+# Remembers what was resized, stored in the output directory
+MANIFEST = ".resize4hdtv.json"
+# Save the manifest at least this often (seconds) so an interrupted run does not start over
+MANIFEST_INTERVAL = 30
+# Remembers the input directories listed, stored in the output directory
+INDEX = ".resize4hdtv-index.json"
+# ImageMagick (Q16) keeps 4 channels of 16 bits for each pixel
+BYTES_PER_PIXEL = 8
+# The decoded picture and the resized copy are in memory at the same time
+PIXEL_COPIES = 2
+# Memory estimate for each byte of a file without a readable header
+UNKNOWN_RATIO = 32
+
+# What to do with each picture. Sizes are sorted from the largest to the smallest, quiet drops the per-file output
+Options = collections.namedtuple("Options", "sizes fast_decode quiet")
 SCRIPT = os.path.basename(__file__)
 
 
@@ -34,10 +58,22 @@ def main(argv):
     """ Main method """
     inputdir = ""
     outputdir = ""
+    jobs = 1
+    fast_decode = False
+    staged = False
+    queue_depth = 0
+    buffer_mb = 256
+    renditions = None
+    memory_mb = 0
+    quiet = False
+    timings_path = None
+    duplicates = "skip"
+    use_index = False
     try:
         if len(argv) == 0:
             raise getopt.GetoptError("Must have at least one argument")    
-        opts, _ = getopt.getopt(argv, "hi:o:", ["help", "in=", "out="])
+        opts, _ = getopt.getopt(argv, "hi:o:j:fpr:m:q", ["help", "in=", "out=", "jobs=", "fast", "pipeline", "queue=", "buffer=", "renditions=", "memory=",
+                                                         "quiet", "timings=", "duplicates=", "index"])
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 raise getopt.GetoptError("Help") 
@@ -45,25 +81,79 @@ def main(argv):
                 inputdir = arg
             elif opt in ("-o", "--out"):
                 outputdir = arg
-        resize4hdtv(inputdir, outputdir)
+            elif opt in ("-j", "--jobs"):
+                jobs = _parse_int(arg, "jobs")
+            elif opt in ("-f", "--fast"):
+                fast_decode = True
+            elif opt in ("-p", "--pipeline"):
+                staged = True
+            elif opt == "--queue":
+                queue_depth = _parse_int(arg, "queue depth")
+            elif opt == "--buffer":
+                buffer_mb = _parse_int(arg, "buffer size")
+            elif opt in ("-r", "--renditions"):
+                renditions = [r.strip() for r in arg.split(",") if r.strip()]
+            elif opt in ("-m", "--memory"):
+                memory_mb = _parse_int(arg, "memory")
+            elif opt in ("-q", "--quiet"):
+                quiet = True
+            elif opt == "--timings":
+                timings_path = arg
+            elif opt == "--duplicates":
+                duplicates = arg
+            elif opt == "--index":
+                use_index = True
+        resize4hdtv(inputdir, outputdir, jobs=jobs, fast_decode=fast_decode, 
+                    staged=staged, queue_depth=queue_depth, buffer_size=buffer_mb * pipeline.MB, renditions=renditions,
+                    memory_limit=memory_mb * pipeline.MB, quiet=quiet, timings_path=timings_path,
+                    duplicates=duplicates, use_index=use_index)
     except getopt.GetoptError:
         print("USAGE: {0} <options>".format(SCRIPT))
         print()
         print("OPTIONS:")
         print("   -i <directory>        The input directory")
         print("   -o <directory>        The output directory")
+        print("   -j <number>           Resize in parallel using this many processes, 0 for one per CPU")
+        print("   -f                    Fast decode: let the JPEG decoder scale down while reading")
+        print("   -p                    Pipeline: read, resize (-j threads) and write at the same time")
+        print("   -r <name,...>         Renditions, each in <output directory>/<name>: {0}".format(", ".join(sorted(RENDITIONS))))
+        print("   -m <MB>               Memory budget for pictures being resized, 0 for no limit")
+        print("   -q                    Quiet: no output for each file, only errors and the summary")
         print("   -h                    Show help")
         print("   --in=<directory>      The input directory")
         print("   --out=<directory>     The output directory")
+        print("   --jobs=<number>       Resize in parallel using this many processes, 0 for one per CPU")
+        print("   --fast                Fast decode: let the JPEG decoder scale down while reading")
+        print("   --pipeline            Pipeline: read, resize (-j threads) and write at the same time")
+        print("   --queue=<number>      Pipeline: the number of pictures waiting between stages, default 2 per thread")
+        print("   --buffer=<MB>         Pipeline: the memory for pictures read but not written yet, default 256")
+        print("   --renditions=<name,...> Renditions, each in <output directory>/<name>: {0}".format(", ".join(sorted(RENDITIONS))))
+        print("   --memory=<MB>         Memory budget for pictures being resized, 0 for no limit")
+        print("   --quiet               Quiet: no output for each file, only errors and the summary")
+        print("   --timings=<file>      Write the time of each stage for each file as JSON lines, print a summary at the end")
+        print("   --duplicates=<mode>   What to do with pictures identical to another one: skip (default) or link to the other's output")
+        print("   --index               Do not list again the input directories that did not change since the last run")
+        print("                         (pictures changed in place are not noticed, delete {0} from the output directory to check all)".format(INDEX))
         print("   --help                Show help")
         sys.exit(1)
     except ValidationException as ex:
-        print("ERROR: {1}".format("".join(ex.args)))
+        print("ERROR: {0}".format("".join(ex.args)))
         sys.exit(2)
 
+
+def _parse_int(value, name):
+    """ Parses a non-negative integer option, throws a ValidationException if invalid. """
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    if number < 0:
+        raise ValidationException("Invalid {0}: '{1}'.".format(name, value))
+    return number
+
         
-def _validate(input_dir, output_dir):
-    """ Validates input and output directories """
+def _validate(input_dir, output_dir, renditions=None, duplicates="skip"):
+    """ Validates input and output directories, rendition names and the duplicates mode """
     
     if len(input_dir) == 0 or len(output_dir) == 0:
         raise ValidationException("Must specify an input and an output.") 
@@ -71,88 +161,619 @@ def _validate(input_dir, output_dir):
         raise ValidationException("The input must be different from the output.")
     if not os.path.exists(input_dir):
         raise ValidationException("'{0}' does not exist.".format(input_dir))
+    for name in renditions or []:
+        if name not in RENDITIONS:
+            raise ValidationException("Unknown rendition '{0}', must be one of: {1}.".format(name, ", ".join(sorted(RENDITIONS))))
+    if duplicates not in ("skip", "link"):
+        raise ValidationException("Unknown duplicates mode '{0}', must be skip or link.".format(duplicates))
     
 
-def _accept(dir_, file):
-    """ Returns True if the file should be processed, False if not. """
-    if file.startswith("."):
-        return False
-    return True
-
-
-def resize4hdtv(input_dir, output_dir):
-    """ Walks input directory, creates output directory if needed """
+def resize4hdtv(input_dir, output_dir, jobs=1, fast_decode=False, on_result=None, staged=False, queue_depth=0, buffer_size=256 * pipeline.MB, renditions=None, memory_limit=0, 
+                quiet=False, timings_path=None, duplicates="skip", use_index=False):
+    """ Walks input directory, creates output directory if needed.
+    
+    Arguments:
+        * input_dir -- the directory with the original pictures
+        * output_dir -- the directory for the resized pictures
+        * jobs -- the number of processes resizing in parallel, 0 for one per CPU
+        * fast_decode -- if True, JPEG pictures are decoded at the smallest scale that is still at least the target size
+        * on_result -- if not None, called with the input path, the result (True, False, None) and the seconds it took for each new or changed file
+        * staged -- if True, a reader thread, jobs worker threads and a writer thread work at the same time instead of jobs processes
+        * queue_depth -- staged: the number of pictures waiting between stages, 0 for two per worker
+        * buffer_size -- staged: the number of bytes of pictures read but not written yet
+        * renditions -- the names of RENDITIONS to produce, each in a sub-directory of output_dir; None for SIZE directly in output_dir
+        * memory_limit -- if not 0, the number of bytes for pictures being resized. A picture is admitted only when the memory estimated from
+          its header fits (one picture is always admitted), the ImageMagick memory limits are set to match
+        * quiet -- if True, nothing is printed for each file except errors
+        * timings_path -- if not None, the time of each stage for each file is written to this file as JSON lines and summarized at the end
+        * duplicates -- "skip" or "link": pictures with the same content as another one are resized only once,
+          their outputs are either skipped or hard links to the outputs of the other one
+        * use_index -- if True, input directories whose modification time did not change since the last run are not listed again.
+          Their pictures are neither resized nor compared when looking for duplicates
+    
+    Returns:
+        The counters for dirs, files, unchanged, duplicates, resized and failed pictures
+    """
     print("Resizing...")
-    _validate(input_dir, output_dir)
-    # Counters for dirs, files and resized pictures
-    count = { "dirs": 0, "files": 0, "resized": 0 }
+    _validate(input_dir, output_dir, renditions, duplicates)
+    if renditions:
+        # Largest first, each rendition is scaled down from the previous one
+        names = sorted(set(renditions), key=lambda name: RENDITIONS[name].width * RENDITIONS[name].height, reverse=True)
+        sizes = tuple(RENDITIONS[name] for name in names)
+        trees = [os.path.join(output_dir, name) for name in names]
+    else:
+        sizes = (SIZE,)
+        trees = [output_dir]
+    options = Options(sizes, fast_decode, quiet)
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    # Counters for dirs, files, unchanged, duplicates, resized and failed pictures
+    count = { "dirs": 0, "files": 0, "unchanged": 0, "duplicates": 0, "resized": 0, "failed": 0 }
+    manifest = _load_manifest(output_dir)
+    settings = _settings_hash(options)
+    index = scanner.Index(os.path.join(output_dir, INDEX), input_dir, [settings] + [os.path.relpath(tree, output_dir) for tree in trees]) if use_index else None
+    tasks, copies, hashes = _plan(list(_walk(input_dir, trees, count, settings, index)), manifest, count, input_dir, trees, settings)
     
-    for src_dir, _, files in os.walk(input_dir):
-        count["dirs"] += 1
-        rel = os.path.relpath(src_dir, input_dir)
-        dst_dir = os.path.join(output_dir, rel)
-        if not os.path.exists(dst_dir):
-            print("{0} does not exist, creating...".format(dst_dir))
-            os.makedirs(dst_dir)
-        for f in files:
-            if not _accept(src_dir, f):
+    if staged:
+        _limit_resources(memory_limit)
+        results = _resize_staged(tasks, options, jobs, queue_depth or 2 * jobs, buffer_size, memory_limit)
+    elif jobs == 1:
+        _limit_resources(memory_limit)
+        results = ((task, _resize_timed(task, options)) for task in tasks)
+    else:
+        results = _resize_pooled(tasks, options, jobs, memory_limit)
+        
+    recorder = timings.Recorder(timings_path) if timings_path else None
+    saved = time.monotonic()
+    # Input paths of the originals that failed, their duplicates are tried again with them next time
+    failed = set()
+    try:
+        for task, result in results:
+            result, elapsed, output, stages = result
+            print(output, end="")
+            if on_result is not None:
+                on_result(task[0], result, elapsed)
+            if recorder is not None:
+                recorder.record(task[0], _RESULTS[result], elapsed, stages)
+            if result is None:
+                count["failed"] += 1
+                failed.add(task[0])
+                if index is not None:
+                    # Try again next time
+                    index.discard(os.path.dirname(task[0]))
                 continue
-            src_path = os.path.join(src_dir, f)
-            dst_path = os.path.join(dst_dir, f)
-            count["files"] += 1
-            if _resize(src_path, dst_path):
+            if result:
                 count["resized"] += 1
+            # Skipped files are remembered too, they will be skipped again until they change. The hash finds their duplicates
+            _, _, key, stamp = task
+            manifest[key] = stamp + [hashes[task[0]]] if task[0] in hashes else stamp
+            if time.monotonic() - saved > MANIFEST_INTERVAL:
+                _save_manifest(output_dir, manifest)
+                saved = time.monotonic()
+        # The originals are done, now their outputs can be linked
+        for task, original in copies:
+            if original[0] in failed:
+                if index is not None:
+                    index.discard(os.path.dirname(task[0]))
+                continue
+            if _copy(task, original, duplicates, options):
+                # Unchanged only as long as the original is
+                manifest[task[2]] = task[3] + [hashes[task[0]], original[2]]
+            else:
+                count["failed"] += 1
+                if index is not None:
+                    index.discard(os.path.dirname(task[0]))
+    finally:
+        results.close()
+        _save_manifest(output_dir, manifest)
+        if recorder is not None:
+            recorder.close()
+    if index is not None:
+        # Only after a complete run, an interrupted one did not get to all the pictures listed
+        index.save()
                
-    print("{0} directories, {1} files, {2} pictures resized.".format(count["dirs"], count["files"], count["resized"])) 
+    if recorder is not None:
+        print("\n".join(recorder.summary()))
+        print("Timings saved to {0}".format(timings_path))
+    print("{0} directories, {1} files, {2} unchanged, {3} duplicates, {4} pictures resized, {5} failed.".format(
+        count["dirs"], count["files"], count["unchanged"], count["duplicates"], count["resized"], count["failed"])) 
     print("Done.")
+    return count
+
+
+def _walk(input_dir, trees, count, settings, index=None):
+    """ Generates (input path, output paths, manifest key, manifest stamp) tuples, one output path per output tree.
+    Creates output sub-directories as needed. Skips the directories unchanged according to the index.
+    """
+    files = scanner.Scanner(input_dir, filters=(scanner.not_hidden,), index=index)
+    for src_dir, entries in files.walk():
+        rel = os.path.relpath(src_dir, input_dir)
+        dst_dirs = [os.path.join(tree, rel) for tree in trees]
+        for dst_dir in dst_dirs:
+            if not os.path.exists(dst_dir):
+                print("{0} does not exist, creating...".format(dst_dir))
+                os.makedirs(dst_dir)
+        for entry in entries:
+            dst_paths = tuple(os.path.join(dst_dir, entry.name) for dst_dir in dst_dirs)
+            count["files"] += 1
+            try:
+                st = entry.stat()
+            except OSError as ex:
+                # A broken link or a file deleted since listed
+                print("ERROR: {0}: {1}".format(entry.path, ex))
+                count["failed"] += 1
+                if index is not None:
+                    index.discard(src_dir)
+                continue
+            key = os.path.normpath(os.path.join(rel, entry.name))
+            stamp = [st.st_size, st.st_mtime_ns, settings]
+            yield entry.path, dst_paths, key, stamp
+    count["dirs"] += files.dirs
+
+
+def _plan(tasks, manifest, count, input_dir, trees, settings):
+    """ Returns the new or changed tasks to resize, (task, original task) pairs for new or changed pictures identical to another one
+    and the hashes computed: input path -> [hash of the leading chunk, hash of the whole content or None].
+
+    Pictures are compared in stages like dedupe.find_duplicates(): only new or changed pictures with the same size as another
+    picture are read, first their leading chunk, then the whole file only if another picture has the same leading chunk.
+    They are compared with each other and, through the hashes kept in the manifest, with the pictures resized before: a new copy
+    of an unchanged picture uses the outputs already there. The hashes of unchanged pictures are computed once, when first
+    needed, and kept in the manifest.
+    """
+    by_key = { task[2]: task for task in tasks }
+    fresh = []
+    for task in tasks:
+        if _unchanged(task, manifest, by_key, input_dir):
+            count["unchanged"] += 1
+        else:
+            fresh.append(task)
+    fresh_keys = { task[2] for task in fresh }
+    sizes = collections.Counter(task[3][0] for task in fresh)
+
+    # The unchanged pictures of the sizes of the new ones: key -> hashes, the same list as in the manifest
+    library = collections.OrderedDict()
+    for key, entry in list(manifest.items()):
+        if key in fresh_keys or len(entry) > 4 or entry[2] != settings or entry[0] not in sizes:
+            continue
+        if key not in by_key and _stat_stamp(input_dir, key, settings) != entry[:3]:
+            # Deleted or changed in a directory not listed
+            continue
+        if _hashes(entry) is None:
+            try:
+                manifest[key] = entry = entry[:3] + [[dedupe.head_hash(os.path.join(input_dir, key)), None]]
+            except OSError:
+                continue
+        library[key] = entry[3]
+    library_sizes = { manifest[key][0] for key in library }
+
+    hashes = {}
+    for task in fresh:
+        size = task[3][0]
+        if sizes[size] > 1 or size in library_sizes:
+            try:
+                hashes[task[0]] = [dedupe.head_hash(task[0]), None]
+            except OSError:
+                # Resizing will report it
+                pass
+    # (size, hash of the leading chunk) -> number of pictures. Only pictures sharing both are read whole
+    heads = collections.Counter((manifest[key][0], digests[0]) for key, digests in library.items())
+    heads.update((task[3][0], hashes[task[0]][0]) for task in fresh if task[0] in hashes)
+
+    # (size, hash of the whole content) -> key of the original, the unchanged pictures first
+    known = {}
+    for key, digests in library.items():
+        size = manifest[key][0]
+        if heads[size, digests[0]] < 2:
+            continue
+        if digests[1] is None:
+            try:
+                digests[1] = _full_hash(os.path.join(input_dir, key), size, digests[0])
+            except OSError:
+                continue
+        known.setdefault((size, digests[1]), key)
+
+    todo = []
+    copies = []
+    for task in fresh:
+        size = task[3][0]
+        digests = hashes.get(task[0])
+        if digests is not None and heads[size, digests[0]] > 1:
+            try:
+                digests[1] = _full_hash(task[0], size, digests[0])
+            except OSError:
+                # Resizing will report it
+                pass
+        if digests is None or digests[1] is None:
+            todo.append(task)
+            continue
+        original = known.get((size, digests[1]))
+        if original is None:
+            known[(size, digests[1])] = task[2]
+            todo.append(task)
+        else:
+            count["duplicates"] += 1
+            copies.append((task, by_key.get(original) or _task(input_dir, trees, original, manifest[original][:3])))
+    return todo, copies, hashes
+
+
+def _hashes(entry):
+    """ Returns the [leading chunk hash, whole content hash or None] of a manifest entry, None if not hashed yet. """
+    if len(entry) < 4 or not isinstance(entry[3], list):
+        # Not hashed, or by a version that kept only the hash of the whole content
+        return None
+    return entry[3]
+
+
+def _full_hash(path, size, head_hash):
+    """ Returns the hash of the whole content of a picture, the hash of the leading chunk if that is the whole picture. """
+    return head_hash if size <= dedupe.CHUNK_SIZE else dedupe.content_hash(path)
+
+
+def _unchanged(task, manifest, by_key, input_dir):
+    """ Returns True if the picture did not change since recorded in the manifest. A duplicate is unchanged only while its original is. """
+    entry = manifest.get(task[2])
+    if entry is None or entry[:3] != task[3]:
+        return False
+    if len(entry) < 5:
+        return True
+    original = manifest.get(entry[4])
+    if original is None or len(original) < 4 or original[3] != entry[3]:
+        return False
+    if entry[4] in by_key:
+        return by_key[entry[4]][3] == original[:3]
+    return _stat_stamp(input_dir, entry[4], task[3][2]) == original[:3]
+
+
+def _stat_stamp(input_dir, key, settings):
+    """ Returns the manifest stamp of a picture not listed, None if it cannot be found. """
+    try:
+        st = os.stat(os.path.join(input_dir, key))
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, settings]
+
+
+def _task(input_dir, trees, key, stamp):
+    """ Returns the task of a picture not listed, like _walk() does. """
+    return os.path.join(input_dir, key), tuple(os.path.join(tree, key) for tree in trees), key, stamp
+
+
+def _copy(task, original, duplicates, options):
+    """ Skips a duplicate or links its outputs to the outputs of the original. Returns False if linking failed. """
+    if not options.quiet:
+        print("{0} - > duplicate of {1}, {2}...".format(task[0], original[0], "skipping" if duplicates == "skip" else "linking"))
+    if duplicates == "skip":
+        return True
+    if not all(os.path.exists(path) for path in original[1]):
+        # Nothing to link to: fine if the original is not a picture, the duplicate is not either
+        try:
+            if sniff.mime_type(original[0]) != sniff.JPEG:
+                return True
+        except OSError:
+            pass
+        print("ERROR: {0}: the outputs of {1} are missing".format(task[0], original[0]))
+        return False
+    try:
+        for src, dst in zip(original[1], task[1]):
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.link(src, dst)
+    except OSError as ex:
+        print("ERROR: {0}: {1}".format(task[0], ex))
+        return False
+    return True
+
+
+def _settings_hash(options):
+    """ Returns a short hash of everything that changes the resized pictures. """
+    settings = [options.sizes, RESOLUTION, sorted(UNSHARP.items()), options.fast_decode]
+    return hashlib.sha1(json.dumps(settings).encode("utf-8")).hexdigest()[:16]
+
+
+def _load_manifest(output_dir):
+    """ Returns a dictionary: path relative to the input directory -> [size, mtime in ns, settings hash, hashes, original].
+    The hashes, [hash of the leading chunk, hash of the whole content or None], are there if the picture was compared with others,
+    the original (its path relative to the input directory) for duplicates. """
+    path = os.path.join(output_dir, MANIFEST)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        print("Cannot read {0}, resizing everything...".format(path))
+        return {}
+
+
+def _save_manifest(output_dir, manifest):
+    """ Saves the manifest, replaces the previous one only after the new one was written completely. """
+    if not os.path.exists(output_dir):
+        return
+    path = os.path.join(output_dir, MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+# Results of _resize() as recorded in the timings
+_RESULTS = { True: "resized", False: "skipped", None: "failed" }
+
+
+def _silent(*args):
+    """ Prints nothing, used instead of print() when quiet. """
+    pass
+
+
+def _try_resize(input_path, output_paths, options, timer):
+    """ Resizes one image, returns True if resized, False if skipped, None if failed. One bad picture does not stop the batch. """
+    try:
+        return _resize(input_path, output_paths, options, timer, _silent if options.quiet else print)
+    except Exception as ex:
+        print("ERROR: {0}: {1}".format(input_path, ex))
+        return None
+
+
+def _resize_timed(task, options):
+    """ Returns the result, the seconds it took, the output (empty, already printed) and the seconds for each stage. """
+    timer = timings.StageTimer()
+    start = time.perf_counter()
+    result = _try_resize(task[0], task[1], options, timer)
+    return result, time.perf_counter() - start, "", timer.stages
+
+
+def _resize_captured(task, options):
+    """ Runs in a worker process. Returns the same as _resize_timed() with everything printed as output, the main process prints it in order. """
+    with io.StringIO() as buf:
+        with contextlib.redirect_stdout(buf):
+            result, elapsed, _, stages = _resize_timed(task, options)
+        return result, elapsed, buf.getvalue(), stages
     
     
-def _resize(input_path, output_path):
-    """ Resizes one image, saves as JPG """
+def _resize_pooled(tasks, options, jobs, memory_limit):
+    """ Generates the same results as _resize_timed() using a pool of processes.
     
-    print("{0} - > {1}".format(input_path, output_path))
-    if os.path.exists(output_path):
-        print("Already resized, skipping...")
-        return False
-    match = re.search("\(\d+\)\.jpg", input_path)
-    if match:
-        print("Duplicate, skipping...")
-        return
+    Results are returned in the order of the tasks, the output is the same no matter which process finishes first.
+    With a memory limit, a task is submitted only when its estimated memory fits next to the tasks already running.
+    """
+    import concurrent.futures
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_limit_resources, initargs=(memory_limit // jobs,))
+    # [task, estimated memory, future] in the order of the tasks, the memory is set to 0 when released
+    pending = collections.deque()
+    used = 0
+    try:
+        for task in tasks:
+            cost = _estimate(task[0], options) if memory_limit else 0
+            # Enough work queued to keep the processes busy without getting too far ahead of the oldest task
+            while pending and (len(pending) >= jobs * 4 or (memory_limit and used + cost > memory_limit)):
+                running = [p[2] for p in pending if not p[2].done()]
+                if running:
+                    concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for p in pending:
+                    if p[1] and p[2].done():
+                        used -= p[1]
+                        p[1] = 0
+                while pending and pending[0][2].done():
+                    done = pending.popleft()
+                    yield done[0], done[2].result()
+            used += cost
+            pending.append([task, cost, executor.submit(_resize_captured, task, options)])
+        while pending:
+            done = pending.popleft()
+            yield done[0], done[2].result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _limit_resources(memory_limit):
+    """ Sets the ImageMagick memory limits, beyond the limits ImageMagick caches pixels on disk instead. """
+    if memory_limit:
+        from wand.resource import limits
+        limits["memory"] = memory_limit
+        limits["map"] = memory_limit
+
+
+def _estimate(input_path, options, data=None):
+    """ Estimates the memory needed to resize one picture from the width and height in its header, without decoding it. """
+    if data is None:
+        size = sniff.image_size(input_path)
+    else:
+        size = sniff.image_size_from_bytes(data)
+    if size is None:
+        # Unknown header: guess from the file size
+        return (os.path.getsize(input_path) if data is None else len(data)) * UNKNOWN_RATIO
+    width, height = size
+    if options.fast_decode:
+        width, height = _decoded_size(width, height, options.sizes[0])
+    largest = options.sizes[0]
+    return (width * height + largest.width * largest.height) * BYTES_PER_PIXEL * PIXEL_COPIES
+
+
+def _decoded_size(width, height, size):
+    """ Returns the size a fast decode produces: the JPEG decoder scales by 1/8, 1/4 or 1/2 without going below the hint. """
+    hint = _size_hint(width, height, size)
+    if hint is None:
+        return width, height
+    for denom in (8, 4, 2):
+        scaled = (-(-width // denom), -(-height // denom))
+        if scaled[0] >= hint.width and scaled[1] >= hint.height:
+            return scaled
+    return width, height
+
+
+def _resize_staged(tasks, options, workers, queue_depth, buffer_size, memory_limit=0):
+    """ Generates the same results as _resize_timed() using a Pipeline: pictures are read, resized and written at the same time. 
+    
+    The worker threads spend most of the time in ImageMagick, which does not hold the GIL.
+    With a memory limit, the memory estimated for decoding is added to the bytes read and the limit replaces the buffer size.
+    """
+    log = _silent if options.quiet else None
+    
+    def read(item):
+        task, lines, timer, _ = item
+        input_path, output_paths = task[0], task[1]
+        (log or lines.append)("{0} - > {1}".format(input_path, ", ".join(output_paths)))
+        with timer.stage("read"):
+            with open(input_path, "rb") as f:
+                data = f.read()
+        with timer.stage("sniff"):
+            mime = _mime_type(input_path, data)
+        if mime != sniff.JPEG:
+            return None, 0
+        if memory_limit:
+            return data, len(data) + _estimate(input_path, options, data)
+        return data, len(data)
+    
+    def process(item, data):
+        if data is None:
+            return None, 0
+        _, lines, timer, _ = item
+        with timer.stage("decode"):
+            img = _decode(options, blob=data)
+        with img:
+            data = list(_render(img, options.sizes, timer, log or lines.append))
+        return data, sum(len(d) for d in data)
+    
+    def write(item, data):
+        if data is None:
+            return False
+        task, _, timer, _ = item
+        with timer.stage("save"):
+            for output_path, d in zip(task[1], data):
+                _write(output_path, d)
+        return True
+        
+    def items():
+        for task in tasks:
+            # The stages of one picture run one after the other, never at the same time: the timer needs no lock
+            yield task, [], timings.StageTimer(), time.perf_counter()
+        
+    staged = pipeline.Pipeline(read, process, write, workers=workers, depth=queue_depth, max_bytes=memory_limit or buffer_size)
+    for item, result, error in staged.run(items()):
+        task, lines, timer, start = item
+        if error is not None:
+            lines.append("ERROR: {0}: {1}".format(task[0], error))
+        lines.append("")
+        yield task, (result, time.perf_counter() - start, "\n".join(lines), timer.stages)
+        
+
+def _mime_type(input_path, data):
+    """ Sniffs the type from the bytes already read, asks libmagic only if ambiguous. """
+    try:
+        return sniff.mime_type_from_header(data[:sniff.HEADER_SIZE])
+    except sniff.Ambiguous:
+        return sniff.mime_type(input_path)
+
+
+def _resize(input_path, output_paths, options, timer, log=print):
+    """ Resizes one image to each size in options, saves as JPG """
+    
+    log("{0} - > {1}".format(input_path, ", ".join(output_paths)))
         
-    t = str(magic.from_file(input_path, mime=True))
-    if t.find("image/jpeg") < 0:
+    with timer.stage("sniff"):
+        mime = sniff.mime_type(input_path)
+    if mime != sniff.JPEG:
         return False
     
-    with Image(filename=input_path) as img:
-        print("Old size    : {0}x{1}".format(img.width, img.height))
-        img.resolution = RESOLUTION
-        if img.width >= img.height:
-            print("Orientation : Horizontal")
-            s = SIZE.width / img.width
-            size = Size(int(img.width * s), int(img.height * s))   
+    with timer.stage("decode"):
+        img = _decode(options, filename=input_path)
+    with img:
+        for output_path, data in zip(output_paths, _render(img, options.sizes, timer, log)):
+            with timer.stage("save"):
+                _write(output_path, data)
+     
+    return True
+
+
+def _render(img, sizes, timer, log=print):
+    """ Generates one sharpened JPEG per size. Sizes must be sorted from the largest to the smallest, each one is scaled down from the previous one. """
+    img.resolution = RESOLUTION
+    for size in sizes:
+        _fit(img, size, timer, log)
+        # Sharpen a copy, the next size is scaled down from the picture before sharpening
+        with timer.stage("clone"):
+            out = img.clone()
+        with out:
+            out.format = "jpeg"
+            with timer.stage("unsharp_mask"):
+                out.unsharp_mask(**UNSHARP)
+            with timer.stage("encode"):
+                data = out.make_blob()
+        yield data
+
+
+def _fit(img, target, timer, log=print):
+    """ Resizes and crops the image to the target size. """
+    log("Old size    : {0}x{1}".format(img.width, img.height))
+    if img.width >= img.height:
+        log("Orientation : Horizontal")
+        s = target.width / img.width
+        size = Size(int(img.width * s), int(img.height * s))   
+        with timer.stage("resize"):
             img.resize(size.width, size.height)
-            # Determine the height of a band to cut from the top and from the bottom of the picture
-            y_crop = 0
-            if size.height > SIZE.height:
-                y_crop = int(math.ceil((size.height - SIZE.height) / 2))
-                print("Crop        : 2*{0}".format(y_crop))  
+        # Determine the height of a band to cut from the top and from the bottom of the picture
+        y_crop = 0
+        if size.height > target.height:
+            y_crop = int(math.ceil((size.height - target.height) / 2))
+            log("Crop        : 2*{0}".format(y_crop))  
+            with timer.stage("crop"):
                 img.crop(0, y_crop, img.width, img.height - y_crop)
-                            
-        else:
-            print("Orientation : Vertical")
-            print("Crop        : None")
-            s = SIZE.height / img.height
-            size = Size(int(img.width * s), int(img.height * s))
+                        
+    else:
+        log("Orientation : Vertical")
+        log("Crop        : None")
+        s = target.height / img.height
+        size = Size(int(img.width * s), int(img.height * s))
+        with timer.stage("resize"):
             img.resize(size.width, size.height)
-               
-        print("New size    : {0}x{1}".format(img.width, img.height)) 
-        img.format = "jpeg"
-        # Sharpen the image. Parameters found somewhere here:
-        # http://www.imagemagick.org/Usage/blur/#sharpen
-        img.unsharp_mask(radius=2, sigma=1, amount=0.8, threshold=0.016)
-        img.save(filename=output_path)
-     
-    return True
+           
+    log("New size    : {0}x{1}".format(img.width, img.height)) 
+
+
+def _write(output_path, data):
+    """ Writes the encoded picture to a temporary file next to the output and renames it: the output is either complete or missing. """
+    output_dir, output_file = os.path.split(output_path)
+    tmp_path = os.path.join(output_dir, ".{0}.tmp".format(output_file))
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _decode(options, filename=None, blob=None):
+    """ Decodes one image from a file or from the bytes already read. 
+    
+    With fast_decode, reads the picture size from the header first and passes a size hint to the JPEG decoder.
+    The decoder then uses DCT scaling (1/2, 1/4, 1/8) and returns the smallest picture that is still at least
+    as large as the size needed for the largest size, the resize and the crop work as before on a smaller picture.
+    """
+    # Loads ImageMagick, only when there is something to resize
+    from wand.image import Image
+    if not options.fast_decode:
+        return Image(filename=filename, blob=blob)
+    with Image.ping(filename=filename, blob=blob) as header:
+        hint = _size_hint(header.width, header.height, options.sizes[0])
+    img = Image()
+    if hint:
+        img.options["jpeg:size"] = "{0}x{1}".format(hint.width, hint.height)
+    img.read(filename=filename, blob=blob)
+    return img
+
+
+def _size_hint(width, height, size):
+    """ Returns the smallest size the picture can be decoded at without losing detail in the resized picture or None if the picture is not larger than size. """
+    if width >= height:
+        s = size.width / width
+    else:
+        s = size.height / height
+    if s >= 1:
+        return None
+    return Size(int(math.ceil(width * s)), int(math.ceil(height * s)))
 
 
 if __name__ == "__main__":
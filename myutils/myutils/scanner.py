@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""
+Lists the files of a directory tree for flatten, date2dir and resize4hdtv.
+
+Each directory is listed once with os.scandir(). The entries cache what the listing already told (file or directory)
+and the result of stat(), so asking again costs no system call. Which files and directories are taken is decided
+by filters, functions of an entry returning True or False, combined with all_of(), any_of() and none_of().
+
+An optional index remembers the modification time and the sub-directories of each directory. A directory whose
+modification time did not change since the last run is not listed again: its files are skipped and only its
+sub-directories are visited. The modification time of a directory changes when files are added, removed or renamed,
+not when a file is changed in place, so the index suits trees where files are added rather than edited, like photo libraries.
+"""
+
+import sys, os, json, time
+
+if __package__:
+    from . import sniff
+else:
+    # Run as a script
+    import sniff
+
+# A directory modified this recently may change again within the resolution of the file system time, list it again next time
+RACY_SECONDS = 2
+
+
+def not_hidden(entry):
+    """ Filter: the name does not start with a dot. """
+    return not entry.name.startswith(".")
+
+
+def is_file(entry):
+    """ Filter: a regular file or a symbolic link to one. """
+    return entry.is_file()
+
+
+def extension(*extensions):
+    """ Returns a filter: the name ends with one of the extensions, ignoring the case. """
+    extensions = tuple(e.lower() for e in extensions)
+    return lambda entry: entry.name.lower().endswith(extensions)
+
+
+def mime_type(*types):
+    """ Returns a filter: the type read from the header of the file is one of the MIME types. Reads the file, put it last. """
+    def accept(entry):
+        try:
+            return sniff.mime_type(entry.path) in types
+        except OSError:
+            return False
+    return accept
+
+
+def not_matching(pattern):
+    """ Returns a filter: the name does not match the compiled regular expression. """
+    return lambda entry: not pattern.match(entry.name)
+
+
+def all_of(*filters):
+    return lambda entry: all(f(entry) for f in filters)
+
+
+def any_of(*filters):
+    return lambda entry: any(f(entry) for f in filters)
+
+
+def none_of(*filters):
+    return lambda entry: not any(f(entry) for f in filters)
+
+
+class Entry(object):
+    """ A file known by name, not found by listing a directory. Looks like an os.DirEntry and caches stat() the same way. """
+
+    def __init__(self, dir_, name):
+        self.name = name
+        self.path = os.path.join(dir_, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def is_dir(self, follow_symlinks=True):
+        return os.path.isdir(self.path) if follow_symlinks else os.path.isdir(self.path) and not os.path.islink(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+class Index(object):
+    """ The modification time and the sub-directories of each directory of a tree, saved as JSON.
+
+    Arguments:
+        * path -- the JSON file
+        * top -- the top of the tree, directories are saved relative to it
+        * tag -- anything saved with the index, the index is discarded if the tag changes. For example the settings of the run
+    """
+
+    def __init__(self, path, top, tag=None):
+        self.path = path
+        self.top = top
+        self.tag = tag
+        # Directory relative to top -> [mtime in ns, names of the sub-directories]
+        self._dirs = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("tag") == tag:
+                self._dirs = saved["dirs"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, AttributeError):
+            print("Cannot read {0}, listing all directories...".format(path))
+
+    def unchanged(self, dir_, st):
+        """ Returns the sub-directories if the directory did not change since listed, None if it must be listed. """
+        saved = self._dirs.get(self._key(dir_))
+        if saved is not None and saved[0] == st.st_mtime_ns:
+            return saved[1]
+        return None
+
+    def update(self, dir_, st, subdirs):
+        """ Remembers a directory that was listed. """
+        if time.time() - st.st_mtime < RACY_SECONDS:
+            self.discard(dir_)
+        else:
+            self._dirs[self._key(dir_)] = [st.st_mtime_ns, subdirs]
+
+    def refresh(self, dir_):
+        """ Remembers the modification time of a listed directory again, keeps its sub-directories. For example after
+        moving files out of it, which changes the modification time the directory had when listed. """
+        saved = self._dirs.get(self._key(dir_))
+        if saved is None:
+            return
+        try:
+            st = os.stat(dir_)
+        except OSError:
+            self.discard(dir_)
+            return
+        self.update(dir_, st, saved[1])
+
+    def discard(self, dir_):
+        """ Forgets a directory, it will be listed next time. For example because a file in it failed. """
+        self._dirs.pop(self._key(dir_), None)
+
+    def save(self):
+        """ Replaces the previous index only after the new one was written completely. """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({ "tag": self.tag, "dirs": self._dirs }, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def _key(self, dir_):
+        return os.path.normpath(os.path.relpath(dir_, self.top))
+
+
+class Scanner(object):
+    """ Lists a tree in the same order as os.walk(): the files of a directory, then each sub-directory in the order listed.
+    Does not follow symbolic links to directories.
+
+    Arguments:
+        * top -- the directory to list
+        * filters -- the files taken pass all these filters
+        * dir_filters -- the sub-directories visited pass all these filters
+        * recursive -- if False, only top is listed
+        * index -- an Index or None. Directories unchanged since the index was saved are not listed
+        * onerror -- called with the OSError if a directory cannot be listed, by default the directory is skipped silently
+
+    After scanning, dirs is the number of directories visited and skipped the number of those not listed thanks to the index.
+    """
+
+    def __init__(self, top, filters=(), dir_filters=(), recursive=True, index=None, onerror=None):
+        self.top = top
+        self.filters = filters
+        self.dir_filters = dir_filters
+        self.recursive = recursive
+        self.index = index
+        self.onerror = onerror
+        self.dirs = 0
+        self.skipped = 0
+
+    def __iter__(self):
+        """ Generates the entries of the files. """
+        for _, files in self.walk():
+            yield from files
+
+    def walk(self):
+        """ Generates (directory path, list of entries of the files) for each directory visited, even without files. """
+        stack = [self.top]
+        while stack:
+            dir_ = stack.pop()
+            self.dirs += 1
+            st = None
+            if self.index is not None:
+                try:
+                    st = os.stat(dir_)
+                except OSError as ex:
+                    self._error(ex)
+                    continue
+                subdirs = self.index.unchanged(dir_, st)
+                if subdirs is not None:
+                    self.skipped += 1
+                    stack.extend(reversed([os.path.join(dir_, name) for name in subdirs]))
+                    continue
+            files = []
+            subdirs = []
+            try:
+                with os.scandir(dir_) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            if self.recursive and not entry.is_symlink() and all(f(entry) for f in self.dir_filters):
+                                subdirs.append(entry.name)
+                        elif all(f(entry) for f in self.filters):
+                            files.append(entry)
+            except OSError as ex:
+                self._error(ex)
+                continue
+            if self.index is not None:
+                self.index.update(dir_, st, subdirs)
+            yield dir_, files
+            # Last in, first out: reversed to visit the sub-directories in the order listed
+            stack.extend(reversed([os.path.join(dir_, name) for name in subdirs]))
+
+    def _error(self, ex):
+        if self.onerror is not None:
+            self.onerror(ex)
+
+
+if __name__ == "__main__":
+    scanner = Scanner(sys.argv[1] if len(sys.argv) > 1 else ".", filters=(not_hidden,), dir_filters=(not_hidden,))
+    for entry in scanner:
+        print(entry.path)
+    print("{0} directories".format(scanner.dirs))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+Detects the type of a picture from the first bytes of the file (the magic numbers) instead of the file name.
+Recognizes JPEG, PNG and HEIC/HEIF. Falls back to libmagic only for files that look ambiguous and only if libmagic is installed.
+Also reads the width and height of JPEG and PNG pictures from the header, without decoding the picture.
+"""
+
+import sys, io, struct
+
+JPEG = "image/jpeg"
+PNG = "image/png"
+HEIC = "image/heic"
+
+# Number of bytes read from the beginning of a file, enough for a ftyp box with a few compatible brands
+HEADER_SIZE = 64
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_HEIC_BRANDS = (b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1")
+# Brands of other ISO media files: movies, not pictures
+_MOVIE_BRANDS = (b"qt  ", b"isom", b"iso2", b"mp41", b"mp42", b"avc1", b"M4V ", b"M4A ", b"3gp4", b"3gp5")
+
+# JPEG start of frame markers, the frame header has the size of the picture. C4, C8 and CC are not frames
+_JPEG_SOF = set(range(0xC0, 0xD0)) - { 0xC4, 0xC8, 0xCC }
+# JPEG markers without a length
+_JPEG_STANDALONE = set(range(0xD0, 0xD9)) | { 0x01 }
+_JPEG_SOS = 0xDA
+
+# The libmagic module: None until needed, False if not installed
+_magic = None
+
+
+class Ambiguous(Exception):
+    """ Raised when the header is not enough to tell the type. """
+
+
+def mime_type(path):
+    """ Returns the MIME type of the specified file or None if it is not a picture we know about. """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    try:
+        return mime_type_from_header(header)
+    except Ambiguous:
+        return _from_magic(path)
+    
+    
+def mime_type_from_header(header):
+    """ Returns the MIME type from the first bytes of a file or None if it is not a picture we know about. 
+    
+    Raises an Ambiguous exception if the bytes look like a picture but are not enough to tell.
+    """
+    if header.startswith(b"\xff\xd8"):
+        # SOI must be followed by another marker
+        if header[2:3] == b"\xff":
+            return JPEG
+        raise Ambiguous()
+    if header.startswith(_PNG_SIGNATURE):
+        return PNG
+    if header[4:8] == b"ftyp":
+        # ISO base media file: box size, "ftyp", major brand, minor version, compatible brands 
+        box_size = int.from_bytes(header[0:4], "big")
+        brands = [header[8:12]] + [header[i:i + 4] for i in range(16, min(box_size, len(header)) - 3, 4)]
+        if any(brand in _HEIC_BRANDS for brand in brands):
+            return HEIC
+        if box_size > len(header) and brands[0] not in _MOVIE_BRANDS:
+            raise Ambiguous()
+    return None
+
+
+def image_size(path):
+    """ Returns (width, height) of a JPEG or PNG picture read from the header or None if unknown. """
+    with open(path, "rb") as f:
+        return _image_size(f)
+
+
+def image_size_from_bytes(data):
+    """ Returns (width, height) of a JPEG or PNG picture already read or None if unknown. """
+    return _image_size(io.BytesIO(data))
+
+
+def _image_size(f):
+    """ Reads only the header: for JPEG, skips from marker to marker until the frame header. """
+    header = f.read(24)
+    if header.startswith(_PNG_SIGNATURE) and header[12:16] == b"IHDR":
+        return struct.unpack(">II", header[16:24])
+    if not header.startswith(b"\xff\xd8"):
+        return None
+    f.seek(2)
+    while True:
+        b = f.read(1)
+        if b != b"\xff":
+            return None
+        # Any number of 0xFF fill bytes can precede a marker
+        while b == b"\xff":
+            b = f.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker in _JPEG_STANDALONE:
+            continue
+        if marker == _JPEG_SOS:
+            # The picture data starts here and there was no frame header
+            return None
+        data = f.read(2)
+        if len(data) < 2:
+            return None
+        length = struct.unpack(">H", data)[0]
+        if marker in _JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            _, height, width = struct.unpack(">BHH", data)
+            return width, height
+        f.seek(length - 2, io.SEEK_CUR)
+
+
+def _from_magic(path):
+    """ Asks libmagic, returns None if libmagic is not installed. """
+    global _magic
+    if _magic is None:
+        try:
+            import magic
+            _magic = magic
+        except ImportError:
+            _magic = False
+    if not _magic:
+        return None
+    t = str(_magic.from_file(path, mime=True))
+    for mime in (JPEG, PNG, HEIC):
+        if t.find(mime) >= 0:
+            return mime
+    if t.find("image/heif") >= 0:
+        return HEIC
+    return None
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        print("{0}: {1}".format(arg, mime_type(arg)))
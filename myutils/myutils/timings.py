@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+Per-stage timing: measures how long each stage of processing one file takes, writes one JSON record per file
+(JSON lines) and summarizes the stages at the end of the run: total seconds, share of the total, p50 and p95.
+Also reports the progress of long runs as a rate instead of one line per file.
+"""
+
+import collections, contextlib, json, math, time
+
+
+class StageTimer(object):
+    """ Accumulates the seconds spent in each stage of one file, in the order the stages were first entered. """
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Times the code in a with block. Time spent in the same stage more than once is added up. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - start
+
+
+class Recorder(object):
+    """ Writes one JSON record per file to a JSON lines file and keeps the numbers for the summary. """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+        # stage name -> list of seconds, one per file that went through the stage
+        self._stages = collections.OrderedDict()
+        self._seconds = []
+
+    def record(self, path, result, seconds, stages):
+        """ Records one file. """
+        json.dump({ "file": path, "result": result, "seconds": round(seconds, 6),
+                    "stages": collections.OrderedDict((k, round(v, 6)) for k, v in stages.items()) }, self._file)
+        self._file.write("\n")
+        self._seconds.append(seconds)
+        for name, value in stages.items():
+            self._stages.setdefault(name, []).append(value)
+
+    def close(self):
+        self._file.close()
+
+    def summary(self):
+        """ Returns the lines of the summary table. """
+        total = sum(sum(values) for values in self._stages.values())
+        lines = ["{0:<14} {1:>6} {2:>10} {3:>6} {4:>10} {5:>10}".format("Stage", "Files", "Total (s)", "Share", "p50 (ms)", "p95 (ms)")]
+        for name, values in self._stages.items():
+            values = sorted(values)
+            lines.append("{0:<14} {1:>6} {2:>10.2f} {3:>5.1f}% {4:>10.1f} {5:>10.1f}".format(
+                name, len(values), sum(values), 100 * sum(values) / total if total else 0,
+                1000 * percentile(values, 50), 1000 * percentile(values, 95)))
+        seconds = sorted(self._seconds)
+        lines.append("{0:<14} {1:>6} {2:>10.2f} {3:>6} {4:>10.1f} {5:>10.1f}".format(
+            "file", len(seconds), sum(seconds), "", 1000 * percentile(seconds, 50), 1000 * percentile(seconds, 95)))
+        return lines
+
+
+class Progress(object):
+    """ Prints "<label>: <done>/<total> files, <rate> files/s" at most once per interval seconds. """
+
+    def __init__(self, label, total, interval=2.0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def update(self, n=1):
+        self.done += n
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._print(now)
+
+    def finish(self):
+        """ Prints the final line. """
+        self._print(time.perf_counter())
+
+    def _print(self, now):
+        seconds = now - self._start
+        print("{0}: {1}/{2} files, {3:.0f} files/s".format(self.label, self.done, self.total, self.done / seconds if seconds else 0))
+
+
+def percentile(sorted_values, p):
+    """ Nearest-rank percentile of a sorted list, 0 if empty. """
+    if not sorted_values:
+        return 0
+    rank = max(1, int(math.ceil(p / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
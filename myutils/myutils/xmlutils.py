@@ -2,12 +2,14 @@
 
 """
 Collection of XML DOM utilities.
+The get_ functions scan the child nodes on each call. ElementIndex indexes the children once for many lookups.
 
 Created on Feb 01, 2017
 
 @author: Florin Rosca
 """
 
+import heapq
 import xml.dom
 
 
@@ -44,12 +46,7 @@ def get_attr(elem, name, def_val):
 
 def get_child(parent, name):
     """ Returns the first child node that matches the specified tag name. """
-    for child in parent.childNodes:
-        if not child.nodeType == xml.dom.Node.ELEMENT_NODE:
-            continue 
-        if child.tagName == name:
-            return child
-    return None
+    return next(iter_children_by_name(parent, name), None)
 
 
 def get_child_or_raise(parent, name, error):
@@ -62,7 +59,7 @@ def get_child_or_raise(parent, name, error):
 
 def get_child_with_attr(parent, tagName, attrName, value):
     """ Returns the first child node that matches the specified tag name and has an attribute with the specified name and value or None if a node cannot be found. """
-    for elem in get_children_by_name(parent, tagName):
+    for elem in iter_children_by_name(parent, tagName):
         if get_attr(elem, attrName, None) == value:
             return elem
     return None
@@ -70,24 +67,100 @@ def get_child_with_attr(parent, tagName, attrName, value):
 
 def get_children_by_name(parent, name):
     """ Returns all child nodes that matches the specified tag name. """
-    children = []
-    for child in parent.childNodes:
-        if not child.nodeType == xml.dom.Node.ELEMENT_NODE:
-            continue
-        if child.tagName == name:
-            children.append(child)
-    return children
+    return list(iter_children_by_name(parent, name))
 
 
 def get_children_by_names(parent, names):
     """ Returns all child nodes that matches one of the specified tag names. """
-    children = []
+    return list(iter_children_by_names(parent, names))
+
+
+def iter_children(parent):
+    """ Generates the child elements, skipping text and other nodes. """
     for child in parent.childNodes:
-        if not child.nodeType == xml.dom.Node.ELEMENT_NODE:
-            continue
+        if child.nodeType == xml.dom.Node.ELEMENT_NODE:
+            yield child
+
+
+def iter_children_by_name(parent, name):
+    """ Generates the child nodes that match the specified tag name, stops scanning when the caller stops. """
+    for child in iter_children(parent):
+        if child.tagName == name:
+            yield child
+
+
+def iter_children_by_names(parent, names):
+    """ Generates the child nodes that match one of the specified tag names, stops scanning when the caller stops. A string is one name. """
+    names = _names(names)
+    for child in iter_children(parent):
         if child.tagName in names:
-            children.append(child)
-    return children
+            yield child
+
+
+class ElementIndex(object):
+    """ The child elements of an element by tag name, built in one pass over the children. Looking up a child by tag name,
+    or by tag name and attribute value, costs the same however many children there are.
+
+    The methods work like the functions of this module without the parent argument. The index is a snapshot: build a new one
+    after adding or removing children.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        # Tag name -> children in document order
+        self._by_name = {}
+        # Child -> position, to merge the children of several tag names in document order
+        self._position = {}
+        for position, child in enumerate(iter_children(parent)):
+            self._by_name.setdefault(child.tagName, []).append(child)
+            self._position[child] = position
+        # (tag name, attribute name) -> attribute value -> first child, built on the first lookup
+        self._by_attr = {}
+
+    def get_child(self, name):
+        """ Returns the first child element with the specified tag name or None. """
+        children = self._by_name.get(name)
+        return children[0] if children else None
+
+    def get_child_or_raise(self, name, error):
+        """ Returns the first child element with the specified tag name or raises a ParseException with the error. """
+        child = self.get_child(name)
+        if child is None:
+            raise ParseException(error)
+        return child
+
+    def get_child_with_attr(self, tagName, attrName, value):
+        """ Returns the first child element with the specified tag name and attribute value or None. """
+        key = (tagName, attrName)
+        values = self._by_attr.get(key)
+        if values is None:
+            values = {}
+            for elem in self._by_name.get(tagName, ()):
+                values.setdefault(get_attr(elem, attrName, None), elem)
+            self._by_attr[key] = values
+        return values.get(value)
+
+    def get_children_by_name(self, name):
+        """ Returns all child elements with the specified tag name. """
+        return list(self._by_name.get(name, ()))
+
+    def get_children_by_names(self, names):
+        """ Returns all child elements with one of the specified tag names, in document order. """
+        return list(self.iter_children_by_names(names))
+
+    def iter_children_by_name(self, name):
+        """ Generates the child elements with the specified tag name. """
+        return iter(self._by_name.get(name, ()))
+
+    def iter_children_by_names(self, names):
+        """ Generates the child elements with one of the specified tag names, in document order. A string is one name. """
+        names = _names(names)
+        return heapq.merge(*(self._by_name.get(name, ()) for name in set(names)), key=self._position.__getitem__)
+
+
+def _names(names):
+    """ Returns the tag names as a collection: a single name can be given as a string. """
+    return (names,) if isinstance(names, str) else names
 
 
 def get_text(elem):
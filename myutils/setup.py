@@ -10,9 +10,11 @@ config = {
     'download_url': 'https://github.com/florin-rosca-us/playground-python/tree/master/myutils',
     'author_email': '',
     'version': '1.0',
-    'install_requires': ['magic', 'wand'],
+    'install_requires': ['wand'],
+    'extras_require': {'magic': ['magic']},
     'packages': ['myutils'],
     'scripts': [],
+    'entry_points': {'console_scripts': ['myutils = myutils.cli:main']},
     'name': 'myutils'
 }
 
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""
+Tests reading the capture time from the headers of JPEG and QuickTime files built byte by byte.
+Run from the myutils directory: python -m unittest discover tests
+"""
+
+import os, sys, shutil, struct, tempfile, time, unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(TESTS_DIR), "myutils"))
+
+import capturedate
+
+
+TIME = time.mktime((2019, 5, 6, 7, 8, 9, 0, 0, -1))
+EXIF_DATE = b"2019:05:06 07:08:09\x00"
+# Modification time of the files, the capture time when the header does not tell
+MTIME = time.mktime((2020, 1, 1, 12, 0, 0, 0, 0, -1))
+
+
+def _tiff(order, tag):
+    """ A TIFF structure with IFD0 pointing to an EXIF IFD holding the date in the tag. """
+    exif_ifd = 8 + 18
+    date = exif_ifd + 18
+    data = (b"II" if order == "<" else b"MM") + struct.pack(order + "HI", 42, 8)
+    data += struct.pack(order + "HHHII", 1, 0x8769, 4, 1, exif_ifd) + struct.pack(order + "I", 0)
+    data += struct.pack(order + "HHHII", 1, tag, 2, len(EXIF_DATE), date) + struct.pack(order + "I", 0)
+    return data + EXIF_DATE
+
+
+def _jpeg(tiff):
+    """ SOI, an APP1 segment with the EXIF, then the start of the picture data. """
+    app1 = b"Exif\x00\x00" + tiff
+    return b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", 2 + len(app1)) + app1 + b"\xff\xda\x00\x02" + b"\x00" * 16
+
+
+def _atom(kind, data, size=None):
+    return struct.pack(">I4s", 8 + len(data) if size is None else size, kind) + data
+
+
+def _movie(mvhd):
+    return _atom(b"ftyp", b"isom\x00\x00\x00\x00") + _atom(b"moov", _atom(b"mvhd", mvhd))
+
+
+class CaptureDateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _capture_time(self, data):
+        path = os.path.join(self.tmp_dir, "file")
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (MTIME, MTIME))
+        return capturedate.capture_time(path)
+
+    def test_jpeg(self):
+        self.assertEqual(self._capture_time(_jpeg(_tiff(">", 0x9003))), TIME)
+        self.assertEqual(self._capture_time(_jpeg(_tiff("<", 0x9003))), TIME)
+        self.assertEqual(self._capture_time(_jpeg(_tiff("<", 0x9004))), TIME)
+
+    def test_jpeg_without_date(self):
+        self.assertEqual(self._capture_time(_jpeg(_tiff("<", 0x0110))), MTIME)
+
+    def test_jpeg_truncated(self):
+        data = _jpeg(_tiff("<", 0x9003))
+        for size in (4, 12, 30, 60):
+            self.assertEqual(self._capture_time(data[:size]), MTIME)
+
+    def test_movie(self):
+        seconds = int(TIME) + capturedate._QUICKTIME_EPOCH
+        self.assertEqual(self._capture_time(_movie(struct.pack(">BxxxI", 0, seconds) + b"\x00" * 92)), int(TIME))
+        self.assertEqual(self._capture_time(_movie(struct.pack(">BxxxQ", 1, seconds) + b"\x00" * 96)), int(TIME))
+
+    def test_movie_time_not_set(self):
+        self.assertEqual(self._capture_time(_movie(b"\x00" * 100)), MTIME)
+
+    def test_movie_truncated(self):
+        # The mvhd header at the end of the file, like a movie still being copied
+        moov = _atom(b"moov", _atom(b"mvhd", b"", size=108), size=116)
+        self.assertEqual(self._capture_time(_atom(b"ftyp", b"isom\x00\x00\x00\x00") + moov), MTIME)
+        # Version 1 without the 64 bit time
+        moov = _atom(b"moov", _atom(b"mvhd", b"\x01\x00\x00\x00\x00\x00", size=120), size=128)
+        self.assertEqual(self._capture_time(_atom(b"ftyp", b"isom\x00\x00\x00\x00") + moov), MTIME)
+
+    def test_not_a_picture(self):
+        self.assertEqual(self._capture_time(b"hello"), MTIME)
+
+
+if __name__ == "__main__":
+    unittest.main()
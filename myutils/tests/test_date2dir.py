@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+Tests date2dir with files created in a temporary directory.
+Run from the myutils directory: python -m unittest discover tests
+"""
+
+import os, sys, contextlib, io, shutil, tempfile, time, unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(TESTS_DIR), "myutils"))
+
+import date2dir, scanner
+
+
+# Modification time of the files, the date they are moved by
+MTIME = time.mktime((2020, 1, 1, 12, 0, 0, 0, 0, -1))
+DATE_DIR = "2020.01.01"
+
+
+class Date2DirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp_dir, "in")
+        self.output_dir = os.path.join(self.tmp_dir, "out")
+        os.makedirs(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(data)
+        os.utime(path, (MTIME, MTIME))
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def _check_no_file_lost(self, io_limit):
+        self._write(os.path.join(self.input_dir, "100CANON", "IMG_0001.JPG"), "first")
+        self._write(os.path.join(self.input_dir, "101CANON", "IMG_0001.JPG"), "second")
+        self._write(os.path.join(self.input_dir, "101CANON", "IMG_0002.JPG"), "third")
+        self._write(os.path.join(self.output_dir, DATE_DIR, "IMG_0002.JPG"), "already there")
+        date2dir.date2dir(self.input_dir, self.output_dir, recursive=True, io_limit=io_limit)
+        # The first file is moved, the others stay where they are
+        self.assertEqual(self._read(os.path.join(self.output_dir, DATE_DIR, "IMG_0001.JPG")), "first")
+        self.assertEqual(self._read(os.path.join(self.input_dir, "101CANON", "IMG_0001.JPG")), "second")
+        self.assertEqual(self._read(os.path.join(self.input_dir, "101CANON", "IMG_0002.JPG")), "third")
+        self.assertEqual(self._read(os.path.join(self.output_dir, DATE_DIR, "IMG_0002.JPG")), "already there")
+        self.assertFalse(os.path.exists(os.path.join(self.input_dir, "100CANON", "IMG_0001.JPG")))
+
+    def test_same_name_not_overwritten(self):
+        self._check_no_file_lost(0)
+
+    def test_same_name_not_overwritten_io_limit(self):
+        self._check_no_file_lost(8)
+
+    def test_index_skips_directories_after_moving(self):
+        self._write(os.path.join(self.input_dir, "IMG_0001.JPG"), "first")
+        self._write(os.path.join(self.input_dir, "100CANON", "IMG_0002.JPG"), "second")
+        racy_seconds = scanner.RACY_SECONDS
+        # The directories were just modified by moving the files out, do not wait for them to settle
+        scanner.RACY_SECONDS = 0
+        try:
+            date2dir.date2dir(self.input_dir, self.input_dir, use_index=True)
+            date2dir.date2dir(self.input_dir, self.input_dir, recursive=True, use_index=True)
+            self.assertTrue(os.path.exists(os.path.join(self.input_dir, DATE_DIR, "IMG_0002.JPG")))
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                date2dir.date2dir(self.input_dir, self.input_dir, recursive=True, use_index=True)
+        finally:
+            scanner.RACY_SECONDS = racy_seconds
+        self.assertIn("2 directories unchanged since the last run.", stdout.getvalue())
+
+    def test_copy_does_not_replace(self):
+        src = os.path.join(self.input_dir, "IMG_0001.JPG")
+        dst = os.path.join(self.output_dir, "IMG_0001.JPG")
+        self._write(src, "new")
+        self._write(dst, "old")
+        with self.assertRaises(FileExistsError):
+            date2dir._copy_and_delete(src, dst)
+        self.assertEqual(self._read(src), "new")
+        self.assertEqual(self._read(dst), "old")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Tests fcp2mydvd with the files in this directory.
+Run from the myutils directory: python -m unittest discover tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+from xml.dom.minidom import parse
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(TESTS_DIR), 'myutils'))
+
+import fcp2mydvd
+
+
+FCP_PATH = os.path.join(TESTS_DIR, 'fcp.xml')
+MYDVD_PATH = os.path.join(TESTS_DIR, 'mydvd.xml')
+OUT_PATH = os.path.join(TESTS_DIR, 'out.xml')
+
+
+class Fcp2MyDvdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.project = fcp2mydvd._get_fcp_project(FCP_PATH, 'Movie', 'Movie')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _splice_and_dom(self, mydvd_path):
+        """ Returns the output of the splice path and of the DOM path for a MyDVD file. """
+        splice_path = os.path.join(self.tmp_dir, 'splice.xml')
+        dom_path = os.path.join(self.tmp_dir, 'dom.xml')
+        self.assertTrue(fcp2mydvd._splice_mydvd_chapters(mydvd_path, self.project, splice_path))
+        fcp2mydvd._set_mydvd_chapters(mydvd_path, self.project, dom_path, dom=parse(mydvd_path))
+        return self._read(splice_path), self._read(dom_path)
+
+    def test_fcp2mydvd(self):
+        out_path = os.path.join(self.tmp_dir, 'out.xml')
+        fcp2mydvd.fcp2mydvd(FCP_PATH, 'Movie', 'Movie', MYDVD_PATH, out_path)
+        self.assertEqual(self._read(out_path), self._read(OUT_PATH))
+
+    def test_fcp2mydvd_dom(self):
+        # The DOM path, as for a MyDVD file the chapters cannot be spliced into
+        out_path = os.path.join(self.tmp_dir, 'out.xml')
+        fcp2mydvd._set_mydvd_chapters(MYDVD_PATH, self.project, out_path, dom=parse(MYDVD_PATH))
+        self.assertEqual(self._read(out_path), self._read(OUT_PATH))
+
+    def test_fcp2mydvd_batch(self):
+        out_paths = [os.path.join(self.tmp_dir, name) for name in ('out1.xml', 'out2.xml')]
+        batch_path = os.path.join(self.tmp_dir, 'batch.csv')
+        with open(batch_path, 'w') as f:
+            for out_path in out_paths:
+                f.write('Movie,Movie,{0},{1}\n'.format(MYDVD_PATH, out_path))
+        fcp2mydvd.fcp2mydvd_batch(FCP_PATH, batch_path)
+        for out_path in out_paths:
+            self.assertEqual(self._read(out_path), self._read(OUT_PATH))
+
+    def test_splice_same_as_dom(self):
+        splice, dom = self._splice_and_dom(MYDVD_PATH)
+        self.assertEqual(splice, dom)
+
+    def test_splice_same_as_dom_other_framing(self):
+        # Another XML declaration, white space around the root element
+        data = self._read(MYDVD_PATH).replace(b'<?xml version="1.0"?>', b'<?xml version="1.0" encoding="UTF-8"?>\n\n', 1)
+        mydvd_path = os.path.join(self.tmp_dir, 'mydvd.xml')
+        with open(mydvd_path, 'wb') as f:
+            f.write(data + b'\n\n')
+        splice, dom = self._splice_and_dom(mydvd_path)
+        self.assertEqual(splice, dom)
+
+    def test_no_splice_with_comment_before_root(self):
+        # Written by the DOM path
+        data = self._read(MYDVD_PATH).replace(b'<MDProject>', b'<!-- MyDVD --><MDProject>', 1)
+        mydvd_path = os.path.join(self.tmp_dir, 'mydvd.xml')
+        with open(mydvd_path, 'wb') as f:
+            f.write(data)
+        self.assertFalse(fcp2mydvd._splice_mydvd_chapters(mydvd_path, self.project, os.path.join(self.tmp_dir, 'out.xml')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Tests flatten with JPEG files created in a temporary directory.
+Run from the myutils directory: python -m unittest discover tests
+"""
+
+import os, sys, contextlib, io, shutil, tempfile, unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(TESTS_DIR), "myutils"))
+
+import flatten
+
+
+# The start of a JPEG file, enough to be taken as one
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 400
+
+
+class FlattenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp_dir, "in")
+        self.output_dir = os.path.join(self.tmp_dir, "out")
+        os.makedirs(self.input_dir)
+        os.makedirs(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _flatten(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            flatten.flatten(self.input_dir, self.output_dir, **kwargs)
+
+    def test_output_of_another_file_not_taken(self):
+        # Written before the journal, not a copy of the input
+        self._write(os.path.join(self.output_dir, "1.jpg"), b"other")
+        self._write(os.path.join(self.input_dir, "a.jpg"), JPEG)
+        self._flatten()
+        self.assertEqual(self._read(os.path.join(self.output_dir, "1.jpg")), b"other")
+        self.assertEqual(self._read(os.path.join(self.output_dir, "2.jpg")), JPEG)
+
+    def test_copy_written_before_the_journal_taken(self):
+        self._write(os.path.join(self.input_dir, "a.jpg"), JPEG)
+        shutil.copy2(os.path.join(self.input_dir, "a.jpg"), os.path.join(self.output_dir, "1.jpg"))
+        self._flatten()
+        self.assertEqual(sorted(name for name in os.listdir(self.output_dir) if not name.startswith(".")), ["1.jpg"])
+
+    def test_duplicates_of_finished_files(self):
+        self._write(os.path.join(self.input_dir, "a.jpg"), JPEG)
+        self._write(os.path.join(self.input_dir, "b.jpg"), JPEG[:-1] + b"b")
+        self._flatten(skip_duplicates=True)
+        self._write(os.path.join(self.input_dir, "c.jpg"), JPEG)
+        self._flatten(skip_duplicates=True)
+        _, duplicate_of, _, hashed = flatten._load_journal(os.path.join(self.output_dir, flatten.JOURNAL))
+        self.assertEqual(duplicate_of, { "c.jpg": "a.jpg" })
+        # The whole content of a.jpg was hashed once and recorded
+        self.assertIsNotNone(hashed["a.jpg"]["hash"])
+        self.assertEqual(len(os.listdir(self.output_dir)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+Tests the staged pipeline of resize4hdtv.
+Run from the myutils directory: python -m unittest discover tests
+"""
+
+import os, sys, threading, time, unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(TESTS_DIR), "myutils"))
+
+import pipeline
+
+
+def _read(item):
+    if item == "bad":
+        raise ValueError(item)
+    return item, 1
+
+
+def _process(item, data):
+    # Finish out of order
+    time.sleep(0.001 * (len(data) % 3))
+    return data.upper(), 1
+
+
+def _write(item, data):
+    return data + "!"
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_order_and_errors(self):
+        items = ["a", "bb", "bad", "ccc", "d"] * 10
+        results = list(pipeline.Pipeline(_read, _process, _write, workers=3, depth=2).run(items))
+        self.assertEqual([item for item, _, _ in results], items)
+        for item, result, error in results:
+            if item == "bad":
+                self.assertIsInstance(error, ValueError)
+            else:
+                self.assertEqual((result, error), (item.upper() + "!", None))
+
+    def test_stopped_early(self):
+        threads = threading.active_count()
+        for max_bytes in (1, 256 * pipeline.MB):
+            results = pipeline.Pipeline(_read, _process, _write, workers=4, depth=1, max_bytes=max_bytes).run(str(i) for i in range(1000))
+            next(results)
+            results.close()
+            # The threads were joined when closing
+            self.assertEqual(threading.active_count(), threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
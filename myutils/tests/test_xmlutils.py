@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""
+Tests that ElementIndex finds the same elements as the functions of xmlutils.
+Run from the myutils directory: python -m unittest discover tests
+"""
+
+import os, sys, unittest
+from xml.dom.minidom import parse, parseString
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(TESTS_DIR), 'myutils'))
+
+import xmlutils
+from xmlutils import ElementIndex, ParseException
+
+
+XML = '''<root>
+    text
+    <a id="1"/><b id="1"/><a id="2"/><!-- comment --><c/><a id="2" n="second"/><b/><ab id="3"/><a/>
+</root>'''
+NAMES = ('a', 'b', 'c', 'ab', 'd', '')
+
+
+class XmlUtilsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = parseString(XML).documentElement
+        self.index = ElementIndex(self.root)
+
+    def test_get_child(self):
+        for name in NAMES:
+            self.assertIs(self.index.get_child(name), xmlutils.get_child(self.root, name))
+
+    def test_get_child_or_raise(self):
+        self.assertIs(self.index.get_child_or_raise('c', 'error'), xmlutils.get_child_or_raise(self.root, 'c', 'error'))
+        with self.assertRaises(ParseException):
+            self.index.get_child_or_raise('d', 'error')
+
+    def test_get_child_with_attr(self):
+        for name in NAMES:
+            for value in ('1', '2', '3', None, 'x'):
+                self.assertIs(self.index.get_child_with_attr(name, 'id', value), xmlutils.get_child_with_attr(self.root, name, 'id', value))
+
+    def test_children_by_name(self):
+        for name in NAMES:
+            self.assertEqual(self.index.get_children_by_name(name), xmlutils.get_children_by_name(self.root, name))
+            self.assertEqual(list(self.index.iter_children_by_name(name)), list(xmlutils.iter_children_by_name(self.root, name)))
+
+    def test_children_by_names(self):
+        for names in (('a', 'b'), ['b', 'a', 'b'], {'c', 'ab'}, (), 'ab', 'a'):
+            expected = xmlutils.get_children_by_names(self.root, names)
+            self.assertEqual(self.index.get_children_by_names(names), expected)
+            self.assertEqual(list(self.index.iter_children_by_names(names)), expected)
+
+    def test_string_is_one_name(self):
+        self.assertEqual([elem.getAttribute('id') for elem in xmlutils.get_children_by_names(self.root, 'ab')], ['3'])
+
+    def test_mydvd(self):
+        doc = parse(os.path.join(TESTS_DIR, 'mydvd.xml')).documentElement
+        index = ElementIndex(doc)
+        for child in xmlutils.iter_children(doc):
+            self.assertIs(index.get_child(child.tagName), xmlutils.get_child(doc, child.tagName))
+
+
+if __name__ == '__main__':
+    unittest.main()